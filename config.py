@@ -100,7 +100,9 @@ defaults = {
         'relief_source': ('rgis',),
         'relief_rast': '#data/rgis/relief{ver}.{ext}',
 
-        'basin_networks': '#data/basin_river_networks.nx.pd',
+        'basin_networks': '#data/basin_river_networks.npz',
+        'basin_upstream_matrices': '#data/basin_upstream_{agg_dist}hops.npz',
+        'res_agg_dist': 3, # network distance over which hydropower potential is aggregated
         'basin_res_potential': '#data/experiments/{exp}/res_potential.pd',
         'basin_res_potential_rast': '#data/experiments/{exp}/res_potential.tif',
         'basin_res_utilization': '#data/experiments/{exp}/res_utilization.pd',
@@ -173,6 +175,7 @@ defaults = {
         'delta_ssp_pops': '#data/ssp/delta_ssp_pops.pd',
         'ssp_gdp_source': ('ssp', '/Users/ztessler/data/SSP_pop_gdp_Murakami/gdp_ssp{ssp}.csv'),
         'ssp_gdp': '#data/ssp/gdp_ssp{ssp}.{ext}',
+        'ssp_cache': '#data/ssp/cache',
         'delta_ssp_gdps': '#data/ssp/delta_ssp_gdps.pd',
         'delta_ssp_gdps_adj': '#data/experiments/{exp}/delta_ssp_gdps_adj.pd',
         'delta_ssp_percap_gdps': '#data/ssp/delta_ssp_percap_gdps.pd',
@@ -198,10 +201,10 @@ defaults = {
         'dis_future_tmp': '#data/isimip/Global_Discharge_{gcm}[RCP{rcp}]+dist_30min_dTS{year}.tmp.{ext}',
         'dis_future_ncs': '#data/isimip/Global_Discharge_{gcm}[RCP{rcp}]+dist_30min_dTS{year}.nc',
         # 'dis_future_ncs': '/Volumes/environmental_science/TesslerZ/data/isimip/Global_Discharge_{gcm}[RCP{rcp}]+dist_30min_dTS{year}.nc',
-        'dis_future_annual': '#data/isimip/dis_future_{rcp}_{year}.pd',
-        'dis_future_rcp': '#data/isimip/dis_future_{rcp}.pd',
-        'dis_future': '#data/isimip/dis_future.pd',
-        'dis_future_hist': '#data/isimip/dis_future_hist.pd',
+        'dis_future': '#data/isimip/dis_future.nc',
+        'dis_future_hist': '#data/isimip/dis_future_hist.nc',
+        'extremes_method': 'mle', # gpd fits: mle, pwm or mom
+        'extremes_cache': '#data/extremes_cache',
         'dis_future_extremes_basins': '#data/experiments/{exp}/dis_future_extreme_zscore_basins.pd',
         'dis_future_hist_extremes_basins': '#data/experiments/{exp}/dis_future_hist_extreme_zscore_basins.pd',
         'dis_future_window_mean_dis': '#data/experiments/{exp}/dis_future_window_means.pd',
@@ -210,6 +213,9 @@ defaults = {
         'dis_future_extremes': '#data/experiments/{exp}/dis_future_extreme_zscore.pd',
 
         'waves_future_source': ('csiro', 'http://tds.csiro.au/thredds/dodsC/Global_wave_projections/{forecast}/CMIP5/{rcp}/{gcm}/ww3_outf_{yyyymm}.nc'),
+        # 'waves_future_source': ('local', '/Users/ztessler/data/Global_wave_projections/{forecast}/CMIP5/{rcp}/{gcm}/ww3_outf_{yyyymm}.nc'),
+        'waves_future_fetch_workers': 8,
+        'waves_future_read_strategy': 'pixel', # 'block' is faster on local files, 'pixel' over opendap
         # 'waves_future_gcms': ['MRI-CGCM3', 'MIROC5', 'INMCM4', 'HadGEM2-ES', 'GFDL-CM3', 'CNRM-CM5', 'BCC-CSM1.1', 'ACCESS1.0'],
         'waves_future_gcms': ['GFDL-CM3'],
         # 'waves_future_forecasts': ['HISTORICAL', 'MID21C', 'END21C'],
@@ -317,12 +323,14 @@ defaults = {
         'cartoon_floods': '#figures/cartoon_floods.png',
 
         'basin_pixel_areas': '#data/basin_pixel_areas.tif',
+        'basin_pixel_index': '#data/basin_pixel_index.npz',
         'upstream_zeros': '#data/upstream_zeros.pd',
         'upstream_ones': '#data/upstream_ones.pd',
         'delta_zeros': '#data/delta_zeros.pd',
         'delta_ones': '#data/delta_ones.pd',
 
         'srtm': 3,
+        'hypso_elevs': range(35+1), # upper bin edges (m) of population hypsometry, inf (total) is always added
         'eustatic_slr': 3.2, # church and white 2011 from sat record, 3.2 [2.8-3.6] between 1993-2010 from ipcc ar5 wg1 ch 3.7.2
         'slr_rate_2100_RCP2.6': 4.4, # IPCC AR5 Table 13.5
         'slr_rate_2100_RCP4.5': 6.1,
@@ -511,6 +519,7 @@ for experiment in experiments.keys():
             'rcp': '{rcp}',
             'year': '{year}',
             'yyyymm': '{yyyymm}',
+            'agg_dist': '{agg_dist}',
             }
     config = experiments[experiment]
     for name, path in config.items():
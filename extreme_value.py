@@ -0,0 +1,106 @@
+import os
+import hashlib
+import numpy as np
+from multiprocessing import Pool
+from scipy.stats import genpareto
+from util import makedirs
+
+
+def threshold_exceedances(data, percentile):
+    '''
+    Peaks over threshold for every column of a (time, series) array.
+    Returns the thresholds (percentile of each column) and the excesses over
+    them, one array per column in time order.
+    '''
+    data = np.asarray(data, dtype=np.float64)
+    u = np.percentile(data, percentile, axis=0)
+    above = (data > u).T
+    excess = (data - u).T[above]
+    return u, np.split(excess, np.cumsum(above.sum(axis=1))[:-1])
+
+
+def fit_gpd_mle(tail):
+    '''Maximum likelihood (shape, loc, scale), as scipy genpareto.fit'''
+    return genpareto.fit(tail)
+
+
+def fit_gpd_mom(tail):
+    '''Method of moments (shape, 0, scale) for excesses over a threshold'''
+    m = np.mean(tail)
+    r = m**2 / np.var(tail, ddof=1)
+    return 0.5 * (1 - r), 0., 0.5 * m * (r + 1)
+
+
+def fit_gpd_pwm(tail):
+    '''
+    Probability weighted moments (shape, 0, scale) for excesses over a
+    threshold (Hosking and Wallis 1987)
+    '''
+    x = np.sort(tail)
+    n = x.size
+    a0 = x.mean()
+    a1 = np.sum(x * np.arange(n-1, -1, -1)) / (n * (n - 1.))
+    return 2 - a0 / (a0 - 2*a1), 0., 2 * a0 * a1 / (a0 - 2*a1)
+
+
+FIT_METHODS = {
+        'mle': fit_gpd_mle,
+        'mom': fit_gpd_mom,
+        'pwm': fit_gpd_pwm,
+        }
+
+
+def series_key(tail, method):
+    md5 = hashlib.md5(np.ascontiguousarray(tail, dtype=np.float64).tostring())
+    md5.update(method)
+    return md5.hexdigest()
+
+
+def fit_gpd(tails, method='mle', processes=1, cache_dir=None):
+    '''
+    Fit a generalized pareto distribution to each tail, returning an (n, 3)
+    array of (shape, loc, scale) in the same order.  Fits run over a process
+    pool when processes > 1; actions pass util.num_processes(), which is 1
+    unless DELTA_PROCESSES is set, so scons -j does not multiply workers.
+    With cache_dir, parameters are stored by a hash of the data and method,
+    and only new series are refit.
+    '''
+    fitter = FIT_METHODS[method]
+    params = np.empty((len(tails), 3))
+    todo = range(len(tails))
+    if cache_dir is not None:
+        keys = [series_key(tail, method) for tail in tails]
+        paths = [os.path.join(cache_dir, key + '.npy') for key in keys]
+        todo = [i for i, path in enumerate(paths) if not os.path.exists(path)]
+        for i in set(range(len(tails))) - set(todo):
+            params[i] = np.load(paths[i])
+
+    if processes > 1 and len(todo) > 1:
+        pool = Pool(min(processes, len(todo)))
+        fits = pool.map(fitter, [tails[i] for i in todo])
+        pool.close()
+        pool.join()
+    else:
+        fits = [fitter(tails[i]) for i in todo]
+
+    for i, fit in zip(todo, fits):
+        params[i] = fit
+    if cache_dir is not None and todo:
+        makedirs(cache_dir)
+        for i in todo:
+            # write then rename, so concurrent builds never read partial files
+            tmp = '{}.{}.tmp.npy'.format(paths[i][:-4], os.getpid())
+            np.save(tmp, params[i])
+            os.rename(tmp, paths[i])
+    return params
+
+
+def return_levels(u, params, percentile, return_period, per_year=365):
+    '''
+    Level exceeded on average once every return_period years, from daily
+    series thresholded at percentile with fitted gpd params (see fit_gpd)
+    '''
+    plu = percentile / 100.
+    pgu = 1 - plu
+    q = (1 - (1. / (return_period * per_year)) - plu) / pgu
+    return u + genpareto.ppf(q, params[:, 0], params[:, 1], params[:, 2])
@@ -12,10 +12,10 @@ import shapely.geometry as sgeom
 import cartopy.crs as ccrs
 from rasterstats import zonal_stats
 from collections import OrderedDict, defaultdict
-import networkx as nx
-import pint
 
-from util import in_new_process, getLogger
+from util import getLogger
+import basin_index as bi
+import river_network as rn
 
 
 def clean_delta_name(delta):
@@ -86,6 +86,15 @@ def contributing_basins(env, target, source):
     return 0
 
 
+def build_basin_pixel_index(env, target, source):
+    with rasterio.open(str(source[0]), 'r') as rast:
+        basins = rast.read(1)
+    basin_ids = pandas.read_pickle(str(source[1]))
+    index = bi.build_pixel_index(basins, basin_ids.index.get_level_values('BasinID'))
+    bi.save_pixel_index(index, str(target[0]))
+    return 0
+
+
 def locate_basin_mouths(env, target, source):
     basin_info = pandas.read_pickle(str(source[0]))
     with rasterio.open(str(source[1]), 'r') as rast:
@@ -204,43 +213,31 @@ def delta_countries(env, target, source):
     return 0
 
 
-@in_new_process
 def build_basin_river_network(env, source, target):
-    ureg = pint.UnitRegistry()
-    Q_ = ureg.Quantity
-
     with rasterio.open(str(source[0]), 'r') as rast:
-        basins = rast.read(1)
-    with rasterio.open(str(source[1]), 'r') as rast:
         flowdir = rast.read(1)
-    mouths = pandas.read_pickle(str(source[2]))
+    mouths = pandas.read_pickle(str(source[1]))
+    index = bi.load_pixel_index(str(source[2]))
 
     logger = getLogger(target)
 
-    neighbors = {
-            1: (1, 0),
-            2: (1, 1),
-            4: (0, 1),
-            8: (-1, 1),
-            16: (-1, 0),
-            32: (-1, -1),
-            64: (0, -1),
-            128: (1, -1),
-            }
-
-    nets = pandas.Series(index=mouths.index, dtype=object)
-    for delta, basinid in nets.index:
+    nets = OrderedDict()
+    for delta, basinid in mouths.index:
         logger.info('{0} - {1}'.format(delta, basinid))
-        G = nx.DiGraph()
-        for y, x in zip(*np.where(basins==basinid)):
-            tocell = int(flowdir[y, x])
-            G.add_node((x, y))
-            if tocell > 0:
-                dx, dy = neighbors[tocell]
-                if basins[y+dy, x+dx] == basinid:
-                    G.add_edge((x, y), (x+dx, y+dy))
-
-        nets[(delta, basinid)] = G
-
-    nets.to_pickle(str(target[0]))
+        nets[(delta, basinid)] = rn.build_network(bi.basin_pixels(index, basinid),
+                                                  flowdir)
+
+    rn.save_networks(str(target[0]), nets)
+    return 0
+
+
+def build_upstream_matrices(env, source, target):
+    networks = rn.load_networks(str(source[0]))
+    agg_dist = env['agg_dist']
+
+    mats = OrderedDict()
+    for key, net in networks.iteritems():
+        mats[key] = rn.upstream_matrix(net, agg_dist)
+
+    rn.save_upstream_matrices(str(target[0]), mats)
     return 0
@@ -1,7 +1,9 @@
+from multiprocessing import Pool
 import numpy as np
 import pandas
 import geopandas
 import rasterio
+from rasterio.features import rasterize
 from rasterio.warp import RESAMPLING, reproject, calculate_default_transform
 from affine import Affine
 from netCDF4 import Dataset
@@ -9,6 +11,8 @@ import cartopy.crs as ccrs
 import shapely.geometry as sgeom
 from rasterstats import zonal_stats
 
+from util import num_processes
+
 
 def regrid_to_06min(env, target, source):
     dst_dx = 0.1
@@ -98,6 +102,30 @@ def georef_nc(env, target, source):
     return 0
 
 
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+
+
+def lat_band_areas(lats, dlon, a=WGS84_A, f=WGS84_F):
+    '''
+    Area in km**2 of a cell dlon degrees wide between each pair of
+    consecutive latitudes in lats (degrees, ascending or descending), on an
+    ellipsoid with semi-major axis a and flattening f (WGS84 by default).
+    Uses the closed-form area of an ellipsoidal zone, so any regular lat/lon
+    grid is handled with a few vector operations.
+    '''
+    e2 = f * (2 - f)
+    e = np.sqrt(e2)
+    sinphi = np.sin(np.radians(np.asarray(lats, dtype=np.float64)))
+    if e == 0: # sphere
+        zone = 2 * sinphi
+    else:
+        zone = (sinphi / (1 - e2 * sinphi**2) +
+                np.log((1 + e * sinphi) / (1 - e * sinphi)) / (2 * e))
+    b2 = a**2 * (1 - e2)
+    return np.abs(np.diff(zone)) * b2 / 2. * np.radians(abs(dlon)) / 1e6
+
+
 def raster_pixel_areas(env, target, source):
     with rasterio.open(str(source[0]), 'r') as rast:
         shape = rast.shape
@@ -105,84 +133,178 @@ def raster_pixel_areas(env, target, source):
         affine = rast.affine
         kwargs = rast.meta
     del kwargs['transform']
-    areas = np.zeros(shape, dtype=np.float)
+    kwargs['dtype'] = np.float64
 
-    if rastcrs['init'] == 'epsg:4326':
-        geod = ccrs.PlateCarree().as_geodetic()
-    else:
-        raise NotImplementedError, 'Only works with lat/lon grid, assumes pixels rows have constant area'
-
-    lon0, lat0 = affine * (0,0)
-    lon1, lat1 = affine * shape[::-1]
-    dlon_2 = affine.a / 2.
-    dlat = affine.e
-    dlat_2 = dlat / 2.
-    lats = np.arange(lat0, lat1, dlat)
-    for j, lat in enumerate(lats):
-        lat_next = lat + dlat
-        laea = ccrs.LambertAzimuthalEqualArea(central_longitude=0,
-                                              central_latitude=lat+dlat_2)
-        poly = sgeom.Polygon(
-                laea.transform_points(geod,
-                                      np.array([-dlon_2, -dlon_2, dlon_2, dlon_2]),
-                                      np.array([lat, lat_next, lat_next, lat])))
-        areas[j,:] = poly.area / 1e6
+    if rastcrs['init'] != 'epsg:4326' or affine.b != 0 or affine.d != 0:
+        raise NotImplementedError, 'Only works with north-up lat/lon grid, assumes pixels rows have constant area'
 
+    lats = affine.f + affine.e * np.arange(shape[0] + 1)
+    row_areas = lat_band_areas(lats, affine.a)
+
+    # write in blocks of rows so fine grids (e.g. 30 arc-second) fit in memory
+    blocksize = max(1, 2**24 // shape[1])
     with rasterio.open(str(target[0]), 'w', **kwargs) as dst:
-        dst.write(areas, 1)
+        for row0 in range(0, shape[0], blocksize):
+            row1 = min(row0 + blocksize, shape[0])
+            areas = np.repeat(row_areas[row0:row1, np.newaxis], shape[1], axis=1)
+            dst.write(areas, 1, window=((row0, row1), (0, shape[1])))
     return 0
 
 
+# raster opened once in each delta_zonal_stats worker process
+zonal_raster = None
+
+
+def open_zonal_raster(path):
+    global zonal_raster
+    zonal_raster = rasterio.open(path)
+
+
+def delta_raster_stats(delta):
+    '''
+    Zonal stats of zonal_raster within delta, a single-row GeoDataFrame, after
+    warping the raster around it to a LAEA projection centered on the delta
+    '''
+    raster = zonal_raster
+    nodata = raster.nodata
+
+    # delta location
+    lon, lat = np.array(delta.centroid.iloc[0])
+    d_minlon, d_minlat, d_maxlon, d_maxlat = delta.bounds.iloc[0]
+
+    # reproject delta shape
+    laea = ccrs.LambertAzimuthalEqualArea(central_longitude=lon,
+                                          central_latitude=lat)
+    delta = delta.to_crs(laea.proj4_params)['geometry']
+
+    # extract minimum raster around delta
+    d_maxy, d_minx = raster.index(d_minlon, d_minlat)
+    d_miny, d_maxx = raster.index(d_maxlon, d_maxlat)
+    window = ((d_miny, d_maxy+1), (d_minx, d_maxx+1))
+    src = raster.read(1, window=window)
+
+    # get size, bounds, affine of raster subset
+    src_height, src_width = src.shape
+    src_bounds = raster.window_bounds(window)
+    src_affine = raster.window_transform(window)
+
+    # reproject raster
+    dst_affine, dst_width, dst_height = calculate_default_transform(
+            raster.crs, laea.proj4_params, src_width, src_height,
+            *src_bounds)
+    dst = np.ones((dst_height, dst_width)) * nodata
+    reproject(src, dst, src_affine, raster.crs, nodata, dst_affine,
+            laea.proj4_params, nodata, RESAMPLING.bilinear)
+
+    # calculate zonal stats
+    _stats = zonal_stats(delta, dst, affine=dst_affine, nodata=nodata)
+    return _stats[0]   # delta only has a single Multipolygon feature
+
+
 def delta_zonal_stats(env, target, source):
     # reprojects delta shape to LamberAzimuthalEqualArea projection
     # centered on delta.  Extracts data from (global) raster, warps to same
-    # projection and calculates zonal stats within delta
+    # projection and calculates zonal stats within delta.  Deltas are
+    # independent, so they are spread over a pool of worker processes
     deltas = geopandas.GeoDataFrame.from_file(str(source[0])).set_index('Delta')
-    raster = rasterio.open(str(source[1]))
-    nodata = raster.nodata
-    minlon, minlat, maxlon, maxlat = raster.bounds
-
-    centroids = deltas.centroid
-    bounds = deltas.bounds
-    stats = {}
-    for dname in deltas.index:
-        # delta location
-        lon, lat = np.array(centroids.loc[dname])
-        d_minlon, d_minlat, d_maxlon, d_maxlat = bounds.loc[dname]
-
-        # reproject delta shape
-        laea = ccrs.LambertAzimuthalEqualArea(central_longitude=lon,
-                                              central_latitude=lat)
-        delta = deltas.loc[[dname]].to_crs(laea.proj4_params)['geometry']
-
-        # extract minimum raster around delta
-        d_maxy, d_minx = raster.index(d_minlon, d_minlat)
-        d_miny, d_maxx = raster.index(d_maxlon, d_maxlat)
-        window = ((d_miny, d_maxy+1), (d_minx, d_maxx+1))
-        src = raster.read(1, window=window)
-
-        # get size, bounds, affine of raster subset
-        src_height, src_width = src.shape
-        src_bounds = raster.window_bounds(window)
-        src_affine = raster.window_transform(window)
-
-        # reproject raster
-        dst_affine, dst_width, dst_height = calculate_default_transform(
-                raster.crs, laea.proj4_params, src_width, src_height,
-                *src_bounds)
-        dst = np.ones((dst_height, dst_width)) * nodata
-        reproject(src, dst, src_affine, raster.crs, nodata, dst_affine,
-                laea.proj4_params, nodata, RESAMPLING.bilinear)
-
-        # calculate zonal stats
-        _stats = zonal_stats(delta, dst, affine=dst_affine, nodata=nodata)
-        _stats = _stats[0]   # delta only has a single Multipolygon feature
-        stats[dname] = _stats
-    raster.close()
+    dnames = list(deltas.index)
+    delta_frames = [deltas.loc[[dname]] for dname in dnames]
+
+    processes = min(num_processes(), len(dnames))
+    if processes > 1:
+        pool = Pool(processes, initializer=open_zonal_raster,
+                    initargs=(str(source[1]),))
+        results = pool.map(delta_raster_stats, delta_frames, chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        open_zonal_raster(str(source[1]))
+        results = map(delta_raster_stats, delta_frames)
+        zonal_raster.close()
+
+    stats = dict(zip(dnames, results))
     pandas.DataFrame.from_dict(stats, orient='index').to_pickle(str(target[0]))
     return 0
 
 
+def rasterize_in_window(geom, src):
+    '''
+    Rasterize geom on the grid of open raster src, allocating only the
+    pixels within geom's bounds.  Returns the tightest window around the
+    rasterized pixels and the mask within it, the same as rasterizing over
+    the full grid and cropping with get_data_window.
+    '''
+    minx, miny, maxx, maxy = geom.bounds
+    cols, rows = zip(~src.affine * (minx, maxy), ~src.affine * (maxx, miny))
+    row0 = max(int(np.floor(min(rows))) - 1, 0)
+    row1 = min(int(np.ceil(max(rows))) + 1, src.height)
+    col0 = max(int(np.floor(min(cols))) - 1, 0)
+    col1 = min(int(np.ceil(max(cols))) + 1, src.width)
+    bounds_window = ((row0, row1), (col0, col1))
+
+    mask = rasterize(geom, default_value=1, fill=0,
+                     out_shape=(row1-row0, col1-col0),
+                     transform=src.window_transform(bounds_window),
+                     dtype=src.dtypes[0])
+    (r0, r1), (c0, c1) = rasterio.get_data_window(mask, 0)
+    window = ((row0+r0, row0+r1), (col0+c0, col0+c1))
+    return window, mask[r0:r1, c0:c1]
+
+
+def grid_index_points(x, y, cellsize=1.):
+    '''
+    Bucket points into square grid cells of cellsize, for fast bounding box
+    queries with query_grid_index
+    '''
+    cells = pandas.DataFrame({'i': np.floor(np.asarray(x) / cellsize).astype(int),
+                              'j': np.floor(np.asarray(y) / cellsize).astype(int)})
+    return cellsize, cells.groupby(['i', 'j']).indices
+
+
+def query_grid_index(index, bounds):
+    '''
+    Sorted positions of the indexed points in grid cells overlapping bounds
+    (minx, miny, maxx, maxy); a superset of the points within bounds
+    '''
+    cellsize, buckets = index
+    minx, miny, maxx, maxy = bounds
+    found = [buckets[(i, j)]
+             for i in range(int(np.floor(minx / cellsize)), int(np.floor(maxx / cellsize)) + 1)
+             for j in range(int(np.floor(miny / cellsize)), int(np.floor(maxy / cellsize)) + 1)
+             if (i, j) in buckets]
+    if not found:
+        return np.array([], dtype=int)
+    return np.sort(np.concatenate(found))
+
+
+def nc_point_series(var, rows, cols, tile=16):
+    '''
+    Time series of a (time, row, col) netCDF variable at each (row, col),
+    as a (time, points) array.  Points are grouped into tile x tile cell
+    blocks and each group is read as the hyperslab bounding its points, so
+    only cells near the points are ever read.  Masked values become nan.
+    '''
+    rows = np.asarray(rows)
+    cols = np.asarray(cols)
+    out = np.empty((var.shape[0], rows.size), dtype=np.float64)
+    groups = pandas.DataFrame({'i': rows // tile, 'j': cols // tile}).groupby(['i', 'j']).indices
+    for pts in groups.values():
+        r0, r1 = rows[pts].min(), rows[pts].max() + 1
+        c0, c1 = cols[pts].min(), cols[pts].max() + 1
+        slab = np.ma.filled(np.ma.asarray(var[:, r0:r1, c0:c1], dtype=np.float64), np.nan)
+        out[:, pts] = slab[:, rows[pts] - r0, cols[pts] - c0]
+    return out
+
+
+def lonlat_to_xyz(lon, lat):
+    '''Points on the unit sphere, as an (n, 3) array, for kd-tree searches'''
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    return np.column_stack([np.cos(lat) * np.cos(lon),
+                            np.cos(lat) * np.sin(lon),
+                            np.sin(lat)])
+
+
 def multiply_rast(env, target, source):
     factor = env['factor']
     with rasterio.open(str(source[0]), 'r') as src:
@@ -0,0 +1,81 @@
+'''
+Time the block and pixel strategies of process_hazards.read_wave_month and
+check that they return the same frame.
+
+    python hazards/bench_wave_reads.py [url indices.json]
+
+With no arguments a synthetic compressed month (248 3-hourly steps on a
+300x600 grid, 10 deltas of 5 nearshore pixels) is written to a temporary
+directory. Otherwise url is a local path or opendap url of one wave month
+and indices.json a waves_future_delta_indices file.
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import numpy as np
+from netCDF4 import Dataset
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import process_hazards as ph
+
+
+def write_month(path, ntimes=248, ny=300, nx=600, nullval=-999.):
+    rng = np.random.RandomState(0)
+    nc = Dataset(path, 'w')
+    nc.createDimension('time', ntimes)
+    nc.createDimension('y', ny)
+    nc.createDimension('x', nx)
+    hours = 3 * np.arange(ntimes)
+    nc.createVariable('time1', 'i4', ('time',))[:] = 20000101 + hours // 24
+    nc.createVariable('time2', 'i4', ('time',))[:] = (hours % 24) * 10000
+    for name, scale in [('Hs', 5.), ('Tm', 15.)]:
+        var = nc.createVariable(name, 'f4', ('time', 'y', 'x'), zlib=True,
+                                fill_value=nullval, chunksizes=(1, ny, nx))
+        var[:] = rng.uniform(0, scale, (ntimes, ny, nx)).astype('f4')
+    nc.close()
+
+
+def random_indices(ny=300, nx=600, ndeltas=10, npixels=5):
+    # a few pixels in a small box per delta, like waves_find_delta_indices
+    rng = np.random.RandomState(1)
+    indices = {}
+    for d in range(ndeltas):
+        y0, x0 = rng.randint(0, ny-8), rng.randint(0, nx-8)
+        cells = rng.choice(64, npixels, replace=False)
+        indices['D{:03}'.format(d)] = {'y': [int(y0 + c // 8) for c in cells],
+                                       'x': [int(x0 + c % 8) for c in cells]}
+    return indices
+
+
+def main(argv):
+    tmpdir = None
+    if len(argv) > 1:
+        url = argv[1]
+        with open(argv[2], 'r') as fin:
+            indices = json.load(fin)
+    else:
+        tmpdir = tempfile.mkdtemp()
+        url = os.path.join(tmpdir, 'waves.nc')
+        write_month(url)
+        indices = random_indices()
+    try:
+        frames = {}
+        for strategy in ['pixel', 'block']:
+            t0 = time.time()
+            frames[strategy] = ph.read_wave_month(url, indices, strategy)
+            print('{0}: {1:.1f}s'.format(strategy, time.time() - t0))
+        same = np.array_equal(frames['pixel'].values.astype(float),
+                              frames['block'].values.astype(float))
+        print('identical: {0}'.format(same))
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+    return 0 if same else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,22 +1,33 @@
 import os
+import glob
 import datetime
 import re
 import json
+import hashlib
 import numpy as np
 import scipy
 import pandas
 import geopandas
 import itertools
 from collections import defaultdict
-from rasterio.features import rasterize
+from multiprocessing import Pool
 import cartopy.crs as ccrs
+import shapely.geometry as sgeom
+from shapely.prepared import prep
+from scipy.spatial import cKDTree
 from netCDF4 import Dataset
 import requests
 from affine import Affine
 from bs4 import BeautifulSoup
 import time
 
-from util import in_new_process
+import gis
+import extreme_value
+from util import num_processes, getLogger, makedirs
+
+
+DIS_STORE_EPOCH = pandas.Timestamp('1900-01-01')
+EARTH_RADIUS_KM = 6371.
 
 
 
@@ -30,6 +41,10 @@ def storm_surge_agg_points(env, target, source):
             {orig:new for orig, new in zip(['geometry']+origcols, ['geometry']+cols)},
             axis=1)
 
+    # index surge points once so each delta only tests nearby ones
+    surge_index = gis.grid_index_points(np.array([p.x for p in allsurges.geometry]),
+                                        np.array([p.y for p in allsurges.geometry]))
+
     centroids = deltas.centroid
     mean_surge = pandas.DataFrame(index=deltas.index, columns=cols, dtype='float')
     for dname in deltas.index:
@@ -38,12 +53,13 @@ def storm_surge_agg_points(env, target, source):
         aed = ccrs.AzimuthalEquidistant(central_longitude=lon,
                                         central_latitude=lat)
         delta = deltas.loc[[dname]].to_crs(aed.proj4_params)['geometry']
-        # buffer around convex hull (very slow over all points)
+        # buffer around convex hull
         delta_buff = delta.convex_hull.buffer(25 * 1000) # 25km
         # project back to match surge data
         poly = delta_buff.to_crs(allsurges.crs).item()
 
-        surges = allsurges[allsurges.within(poly)][cols]
+        nearby = allsurges.iloc[gis.query_grid_index(surge_index, poly.bounds)]
+        surges = nearby[nearby.within(poly)][cols]
 
         # 0 seems to be used as a flag for missing data
         # very small surges also in data, remove these
@@ -52,10 +68,7 @@ def storm_surge_agg_points(env, target, source):
         # remove where there is no or negative increase between levels. larger surges are by defitition rarer
         surges[surges.diff(axis=1) <= 0] = np.nan
         # remove any values at higher levels from bad values
-        for i, col in enumerate(surges):
-            for j in np.where(surges[col].isnull())[0]:
-                for ii in range(i+1, len(cols)):
-                    surges.iloc[j, ii] = np.nan
+        surges[surges.isnull().cumsum(axis=1) > 0] = np.nan
 
         # surges = surges.dropna(axis=0, how='any')
         # for i, level in enumerate(surges):
@@ -122,43 +135,77 @@ def surge_expected_expo(env, target, source):
     return 0
 
 
-@in_new_process
 def extract_future_delta_discharge(env, source, target):
+    # append each year of mouth discharge to a single (time, rcp, basin)
+    # netcdf store, so no more than one year is ever held in memory.
+    # sources are the mouths, then the discharge grids ordered by year then rcp
     mouths = pandas.read_pickle(str(source[0]))
-    year = env['year']
-    nc = Dataset(str(source[1]), 'r')
-    dates = [datetime.datetime(year, 1, 1) + datetime.timedelta(days=float(d)) for d in nc.variables['time'][:]]
-    disgrid = nc.variables['discharge'][:]
-    dis = pandas.DataFrame(
-            disgrid[:, -mouths['y']-1, mouths['x']],
-            index=dates,
-            columns=mouths.index)
-    nc.close()
-    dis.to_pickle(str(target[0]))
-    return 0
-
-
-def combine_future_dis_years(env, source, target):
     years = env['years']
-    dis = []
-    for year, disfile in zip(years, source):
-        dis.append(pandas.read_pickle(str(disfile)))
-    fulldis = pandas.concat(dis, axis=0)
-    fulldis.to_pickle(str(target[0]))
+    rcps = ['RCP' + r for r in env['rcpnames']]
+    ncfiles = [str(s) for s in source[1:]]
+    # grid rows are stored south up
+    xs = mouths['x'].values.astype(int)
+    ys = mouths['y'].values.astype(int)
+
+    store = Dataset(str(target[0]), 'w')
+    store.createDimension('time', None)
+    store.createDimension('rcp', len(rcps))
+    store.createDimension('basin', len(mouths))
+    timevar = store.createVariable('time', 'f8', ('time',))
+    timevar.units = 'days since {:%Y-%m-%d %H:%M:%S}'.format(DIS_STORE_EPOCH)
+    store.createVariable('rcp', str, ('rcp',))[:] = np.array(rcps, dtype=object)
+    store.createVariable('delta', str, ('basin',))[:] = np.array(
+            mouths.index.get_level_values('Delta'), dtype=object)
+    store.createVariable('basinid', 'i4', ('basin',))[:] = mouths.index.get_level_values('BasinID')
+    disvar = store.createVariable('discharge', 'f4', ('time', 'rcp', 'basin'),
+                                  zlib=True, complevel=1,
+                                  chunksizes=(366, 1, len(mouths)))
+
+    t0 = 0
+    for i, year in enumerate(years):
+        for j, rcp in enumerate(rcps):
+            nc = Dataset(ncfiles[i*len(rcps) + j], 'r')
+            # the store has one time axis, shared by every rcp
+            if j == 0:
+                times = nc.variables['time'][:]
+                dates = [datetime.datetime(year, 1, 1) + datetime.timedelta(days=float(d))
+                         for d in times]
+                t1 = t0 + len(dates)
+                timevar[t0:t1] = (pandas.DatetimeIndex(dates) - DIS_STORE_EPOCH) / np.timedelta64(1, 'D')
+            else:
+                assert np.array_equal(nc.variables['time'][:], times), \
+                        '{} time axis differs from {}'.format(ncfiles[i*len(rcps) + j], ncfiles[i*len(rcps)])
+            griddis = nc.variables['discharge']
+            disvar[t0:t1, j, :] = gis.nc_point_series(griddis, griddis.shape[1] - 1 - ys, xs)
+            nc.close()
+        t0 = t1
+    store.close()
     return 0
 
 
-def combine_future_dis_rcps(env, source, target):
-    rcps = [pandas.read_pickle(str(s)) for s in source]
-    names = map(lambda s: 'RCP'+s, env['rcpnames'])
+def open_dis_store(path):
+    '''
+    Open a discharge store written by extract_future_delta_discharge.
+    Returns the open dataset, its dates, rcp names and (Delta, BasinID)
+    index; slice nc.variables['discharge'][times, rcp, :] to read data.
+    '''
+    nc = Dataset(path, 'r')
+    dates = DIS_STORE_EPOCH + pandas.to_timedelta(nc.variables['time'][:], unit='D')
+    rcps = [str(r) for r in nc.variables['rcp'][:]]
+    basins = pandas.MultiIndex.from_arrays(
+            [[str(d) for d in nc.variables['delta'][:]],
+             nc.variables['basinid'][:].tolist()],
+            names=['Delta', 'BasinID'])
+    return nc, dates, rcps, basins
 
-    dis = pandas.concat(rcps, axis=1, keys=names, names=['RCP'])
-    dis.to_pickle(str(target[0]))
-    return 0
+
+def read_dis_store(nc, times, rcp):
+    '''(time, basin) discharge for one rcp as float64, nan where missing'''
+    dis = nc.variables['discharge'][times, rcp, :]
+    return np.ma.filled(np.ma.asarray(dis, dtype=np.float64), np.nan)
 
 
 def model_extremes(env, source, target):
-    from scipy.stats import genpareto
     percentile = float(env['percentile'])
     return_period = float(env['return_period']) #years
     try:
@@ -169,26 +216,27 @@ def model_extremes(env, source, target):
         else:
             raise
 
-    historical = pandas.read_pickle(str(source[0])).astype('float64')
-    if len(source) == 1:
-        dis = pandas.read_pickle(str(source[0])).astype('float64')
+    hist_nc, hist_dates, hist_rcps, basins = open_dis_store(str(source[0]))
+    historical = pandas.DataFrame(
+            read_dis_store(hist_nc, slice(None), hist_rcps.index('RCPnone')),
+            index=hist_dates, columns=basins)
+    if env['nsources'] == 1:
+        nc, dates, rcps = hist_nc, hist_dates, hist_rcps
     else:
-        dis = pandas.read_pickle(str(source[1])).astype('float64')
-    year0 = dis.index[0].strftime('%Y')
-    year1 = dis.index[-1].strftime('%Y')
+        nc, dates, rcps, _ = open_dis_store(str(source[1]))
+    year0 = dates[0].strftime('%Y')
+    year1 = dates[-1].strftime('%Y')
     if window_len is None:
-        windows = [dis.index[[0, -1]]]
+        windows = [slice(0, len(dates))]
     else:
         window0_year_end = str(int(year0)+(window_len-1))
         window1_year_start = str(int(year1)-(window_len-1))
-        windows = [dis[:window0_year_end].index[[0, -1]],
-                   dis[window1_year_start:].index[[0, -1]]]
-    window_names = [' to '.join(map(lambda s: s.strftime('%Y'), window)) for window in windows]
-    window_dict = dict(zip(window_names, windows))
-    rcps = dis.columns.get_level_values('RCP').unique().tolist()
-
-    deltas_basins = dis.columns.droplevel('RCP').unique()
-    d_b_r_w = [tuple(db)+(r, w) for db in deltas_basins for r in rcps for w in window_names]
+        windows = [dates.slice_indexer(None, window0_year_end),
+                   dates.slice_indexer(window1_year_start, None)]
+    window_names = [' to '.join((dates[w][0].strftime('%Y'), dates[w][-1].strftime('%Y')))
+                    for w in windows]
+
+    d_b_r_w = [tuple(db)+(r, w) for db in basins for r in rcps for w in window_names]
     index = pandas.MultiIndex.from_tuples(d_b_r_w,
                         names=['Delta', 'BasinID', 'RCP', 'Window'])
     extremes = pandas.DataFrame(
@@ -196,20 +244,30 @@ def model_extremes(env, source, target):
             columns=['zscore', 'mean', 'std'],
             dtype=np.float64)
 
-    plu = percentile/100.
-    pgu = 1 - plu
-    for (delta, basinid, rcp, winname), rcp_time_data in list(extremes.iterrows()):
-        window = window_dict[winname]
-        d = dis.loc[window[0]:window[1], (rcp, delta, basinid)]
-        d0 = historical.loc[:, ('RCPnone', delta, basinid)]
-        u = np.percentile(d, 100*plu)
-        dtail = d[d>u] - u
-        fit = genpareto.fit(dtail)
-        return_val = u + genpareto.ppf((1-(1./(return_period*365))-plu)/pgu, *fit)
-        zscore = (return_val - d0.mean()) / d0.std(ddof=1)
-        mean = d.mean()
-        std = d.std(ddof=1)
-        extremes.loc[(delta, basinid, rcp, winname)] = (zscore, mean, std)
+    # one (time, basin) slab per rcp and window, read lazily from the store.
+    # tails from every slab are fit together so the pool stays busy
+    thresholds, tails, means, stds = [], [], [], []
+    for r, rcp in enumerate(rcps):
+        for window in windows:
+            dis = pandas.DataFrame(read_dis_store(nc, window, r), columns=basins)
+            u, dtails = extreme_value.threshold_exceedances(dis.values, percentile)
+            thresholds.append(u)
+            tails.extend(dtails)
+            means.append(dis.mean().values)
+            stds.append(dis.std(ddof=1).values)
+    params = extreme_value.fit_gpd(tails, method=env.get('method', 'mle'),
+                               processes=num_processes(),
+                               cache_dir=env.get('cache_dir'))
+    return_vals = extreme_value.return_levels(np.concatenate(thresholds), params,
+                                          percentile, return_period)
+    zscores = (return_vals.reshape(-1, len(basins)) - historical.mean().values) / historical.std(ddof=1).values
+
+    # (rcp, window, basin) to the (basin, rcp, window) row order of extremes
+    for col, vals in [('zscore', zscores), ('mean', means), ('std', stds)]:
+        extremes[col] = np.asarray(vals).reshape(len(rcps), len(windows), len(basins)).transpose(2, 0, 1).ravel()
+    hist_nc.close()
+    if nc is not hist_nc:
+        nc.close()
     extremes.to_pickle(str(target[0]))
     return 0
 
@@ -256,6 +314,8 @@ def get_waves_nclist(env, source, target):
 def waves_find_delta_indices(env, source, target):
     deltas = geopandas.read_file(str(source[0])).set_index('Delta')
     url = env['url']
+    if url is None:
+        raise ValueError('no wave months found in waves_future_source')
     nullval = env['nullval']
     nc = Dataset(url)
     assert nc.variables['y'].long_name == 'Latitude'
@@ -269,6 +329,15 @@ def waves_find_delta_indices(env, source, target):
     dy = (maxy - miny + 1.) / ny
     affine = Affine.from_gdal(minx, dx, 0, miny, 0, dy)
 
+    # kd-tree of valid pixel centers on the unit sphere, built once. each
+    # buffer step is a ball query around the delta for candidate pixels, which
+    # are then tested against the buffered hull in lon/lat, like rasterizing
+    # the buffered hull with all_touched but without touching the whole grid
+    valid_y, valid_x = np.where(~np.ma.getdata(hs==nullval))
+    centers = affine * (valid_x + 0.5, valid_y + 0.5)
+    tree = cKDTree(gis.lonlat_to_xyz(*centers))
+    diag_km = np.radians(np.hypot(dx, dy)) * EARTH_RADIUS_KM
+
     centroids = deltas.centroid
     indices = defaultdict(dict)
 
@@ -278,19 +347,26 @@ def waves_find_delta_indices(env, source, target):
         aed = ccrs.AzimuthalEquidistant(central_longitude=lon,
                                         central_latitude=lat)
         delta = deltas.loc[[dname]].to_crs(aed.proj4_params)['geometry']
-        npixels = 0
+        hull = delta.convex_hull.item()
+        hull_km = np.hypot(*np.asarray(hull.exterior.coords).T).max() / 1000.
+        center = gis.lonlat_to_xyz([lon], [lat])[0]
         for buff_km in itertools.chain([10, 25], itertools.count(50, 50)):
-            # buffer around convex hull (very slow over all points)
+            # buffer around convex hull
             delta_buff = delta.convex_hull.buffer(buff_km * 1000)
-            poly = delta_buff.to_crs(pc.proj4_params).item()
-            mask = rasterize([(poly, 1)], out_shape=(ny, nx), fill=0, transform=affine, all_touched=True)
-            mask[hs==nullval] = 0
-            delta_indices = np.where(mask==1)
-            npixels = len(delta_indices[0])
-            if npixels >= 3:
+            poly = prep(delta_buff.to_crs(pc.proj4_params).item())
+            # search radius padded for the ellipsoid and for hull edges
+            # being straight in lon/lat rather than in the projection
+            radius_km = 1.05 * (hull_km + buff_km) + diag_km
+            chord = 2 * np.sin(min(radius_km / EARTH_RADIUS_KM, np.pi) / 2)
+            cand = np.sort(np.array(tree.query_ball_point(center, chord), dtype=int))
+            x0, y0 = affine * (valid_x[cand], valid_y[cand])
+            x0 = x0 - 360 * np.round((x0 + dx/2. - lon) / 360.) # same side of the dateline as the delta
+            found = np.array([c for c, x, y in zip(cand, x0, y0)
+                              if poly.intersects(sgeom.box(x, y, x + dx, y + dy))], dtype=int)
+            if found.size >= 3:
                 break
-        indices[dname]['y'] = delta_indices[0].tolist()
-        indices[dname]['x'] = delta_indices[1].tolist()
+        indices[dname]['y'] = valid_y[found].tolist()
+        indices[dname]['x'] = valid_x[found].tolist()
         indices[dname]['buffer'] = buff_km
 
     with open(str(target[0]), 'w') as fout:
@@ -298,18 +374,15 @@ def waves_find_delta_indices(env, source, target):
     return 0
 
 
-def process_wave_month(env, source, target):
+def read_wave_month(url, indices, strategy='pixel'):
     # indexing opendap files only download necessary data
     # But, netcdf doesn't do numpy "fancy" indexing to pull out specific indices
     # so can either get data one pixel at a time(v1), entire grid and then use
     # numpy fancy indexing(v2), or get surrounding block for each delta and pull
     # out pixels of interest from the diagonal(v3).
     # v1 is fastest - 1.6 minutes, vs 4.6 vs 7.2
-    # since most time is spent downloading and processing in C code, can use threads
-    # to do different months in parallel to speed this up substaintially
-    url = env['url']
-    with open(str(source[0]), 'r') as fin:
-        indices = json.load(fin)
+    # over opendap. on local files the block strategy (v3, one hyperslab per
+    # delta and variable) is much faster than one read per pixel
     deltas = sorted(indices.keys())
     pixels = [(delta, pixel) for delta in deltas for pixel in range(len(indices[delta]['x']))]
 
@@ -319,25 +392,97 @@ def process_wave_month(env, source, target):
     datetimes = [datetime.datetime.strptime(t, '%Y%m%d:%H%M%S') for t in times]
     timeindex = pandas.DatetimeIndex(datetimes)
     delta_pixels = pandas.MultiIndex.from_tuples(pixels, names=['Delta', 'Pixel'])
-    waves = pandas.DataFrame(index=timeindex, columns=delta_pixels)
 
     power_fac = (1026 * 9.8**2) / (64 * np.pi)
-    for delta in deltas:
-        ys = np.array(indices[delta]['y'])
-        xs = np.array(indices[delta]['x'])
-        for i, (y, x) in enumerate(zip(ys, xs)): #v1 1.6 minutes
-            sig_height = nc.variables['Hs'][:, y, x] #v1
-            period = nc.variables['Tm'][:, y, x] #v1
-            power = power_fac * sig_height**2 * period # W/m of crest #v1
-            waves.loc[:, (delta, i)] = power #v1
+    if strategy == 'block':
+        sig_height = []
+        period = []
+        for delta in deltas:
+            ys = np.array(indices[delta]['y'])
+            xs = np.array(indices[delta]['x'])
+            y0, x0 = ys.min(), xs.min()
+            block = (slice(None), slice(y0, ys.max()+1), slice(x0, xs.max()+1))
+            sig_height.append(nc.variables['Hs'][block][:, ys-y0, xs-x0])
+            period.append(nc.variables['Tm'][block][:, ys-y0, xs-x0])
+        sig_height = np.ma.concatenate(sig_height, axis=1)
+        period = np.ma.concatenate(period, axis=1)
+        power = power_fac * sig_height**2 * period # W/m of crest
+        waves = pandas.DataFrame(power, index=timeindex, columns=delta_pixels)
+    elif strategy == 'pixel':
+        waves = pandas.DataFrame(index=timeindex, columns=delta_pixels)
+        for delta in deltas:
+            ys = np.array(indices[delta]['y'])
+            xs = np.array(indices[delta]['x'])
+            for i, (y, x) in enumerate(zip(ys, xs)): #v1 1.6 minutes
+                sig_height = nc.variables['Hs'][:, y, x] #v1
+                period = nc.variables['Tm'][:, y, x] #v1
+                power = power_fac * sig_height**2 * period # W/m of crest #v1
+                waves.loc[:, (delta, i)] = power #v1
+    else:
+        raise ValueError('strategy must be block or pixel')
     nc.close()
-    waves.to_pickle(str(target[0]))
-    return 0
+    return waves
 
 
-def concat_waves_times(env, source, target):
+def fetch_wave_month(args):
+    # read one month into its cache file, retrying with backoff since the
+    # opendap server drops connections under load. returns the cache path
+    url, cache, indices_file, strategy, retries, wait = args
+    if os.path.exists(cache):
+        return cache
+    logger = getLogger([cache])
+    with open(indices_file, 'r') as fin:
+        indices = json.load(fin)
+    for attempt in range(retries):
+        try:
+            t0 = time.time()
+            waves = read_wave_month(url, indices, strategy)
+            logger.info('{0}: {1} read in {2:.1f}s'.format(url, strategy, time.time()-t0))
+            break
+        except (IOError, RuntimeError):
+            if attempt == retries - 1:
+                raise
+            time.sleep(wait * 2**attempt)
+    # write then rename, so an interrupted fetch never leaves a partial month
+    tmp = '{}.{}.tmp'.format(cache, os.getpid())
+    waves.to_pickle(tmp)
+    os.rename(tmp, cache)
+    return cache
+
+
+def fetch_waves(env, source, target):
+    # fetch all months of a scenario concurrently. urls can be opendap urls
+    # or local netcdf paths, each month is cached on disk so reruns only
+    # fetch what is missing. worker processes rather than threads, since the
+    # netcdf library is not thread safe
+    urls = env['urls']
+    if not urls:
+        raise ValueError('no wave months found for {}'.format(target[0]))
+    strategy = env.get('strategy', 'pixel')
+    # cached months are only valid for the same pixels and read strategy
+    md5 = hashlib.md5()
+    with open(str(source[0]), 'rb') as fin:
+        md5.update(fin.read())
+    md5.update(strategy)
+    caches = ['{0}.{2}{1}'.format(os.path.splitext(cache)[0], os.path.splitext(cache)[1], md5.hexdigest()[:12])
+              for cache in env['caches']]
+    # cache directories are created here, before the workers race for them
+    for cachedir in set(os.path.dirname(cache) for cache in caches):
+        makedirs(cachedir)
+    workers = min(int(env.get('workers', 1)), len(urls))
+    jobs = [(url, cache, str(source[0]), strategy,
+             env.get('retries', 3), env.get('retry_wait', 30))
+            for url, cache in zip(urls, caches)]
+    if workers > 1:
+        pool = Pool(workers)
+        monthfiles = pool.map(fetch_wave_month, jobs, chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        monthfiles = map(fetch_wave_month, jobs)
+
     dfs = []
-    fnames = sorted([str(s) for s in source]) # file names vary only in yyyymm, put them in order
+    fnames = sorted(monthfiles) # file names vary only in yyyymm, put them in order
     for f in fnames:
         dfs.append(pandas.read_pickle(f))
     waves = pandas.concat(dfs, axis=0)
@@ -346,6 +491,13 @@ def concat_waves_times(env, source, target):
     return 0
 
 
+def list_local_wave_months(pathformat):
+    # yyyymm of every monthly file matching a local waves_future_source path
+    head, tail = pathformat.split('{yyyymm}')
+    return sorted(path[len(head):len(path)-len(tail)]
+                  for path in glob.glob(head + '[0-9]'*6 + tail))
+
+
 def waves_avg_pixels(env, source, target):
     waves = pandas.read_pickle(str(source[0]))
     waves = waves.resample('1D', how='mean').dropna(axis=0) # Feb 29 gets np.nan on non-leap-years
@@ -364,33 +516,27 @@ def waves_avg_pixels(env, source, target):
 
 
 def compute_waves_extremes(env, source, target):
-    from scipy.stats import genpareto
     percentile = float(env['percentile'])
     return_period = float(env['return_period']) #years
 
     historical = pandas.read_pickle(str(source[0])).astype('float64')
-    if len(source) == 1:
+    if env['nsources'] == 1:
         waves = pandas.read_pickle(str(source[0])).astype('float64')
     else:
         waves = pandas.read_pickle(str(source[1])).astype('float64')
-
-    extremes = pandas.DataFrame(
+    historical = historical[waves.columns]
+
+    u, wtails = extreme_value.threshold_exceedances(waves.values, percentile)
+    params = extreme_value.fit_gpd(wtails, method=env.get('method', 'mle'),
+                               processes=num_processes(),
+                               cache_dir=env.get('cache_dir'))
+    return_vals = extreme_value.return_levels(u, params, percentile, return_period)
+    extremes = pandas.DataFrame({
+            'zscore': (return_vals - historical.mean().values) / historical.std(ddof=1).values,
+            'mean': waves.mean(),
+            'std': waves.std(ddof=1)},
             index=waves.columns,
-            columns=['zscore', 'mean', 'std'],
-            dtype=np.float64)
-
-    plu = percentile/100.
-    pgu = 1 - plu
-    for delta, w in waves.iteritems():
-        u = np.percentile(w, 100*plu)
-        wtail = w[w>u] - u
-        fit = genpareto.fit(wtail)
-        return_val = u + genpareto.ppf((1-(1./(return_period*365))-plu)/pgu, *fit)
-        w0 = historical.loc[:, delta]
-        zscore = (return_val - w0.mean()) / w0.std(ddof=1)
-        mean = w.mean()
-        std = w.std(ddof=1)
-        extremes.loc[delta] = (zscore, mean, std)
+            columns=['zscore', 'mean', 'std'])
     extremes.to_pickle(str(target[0]))
     return 0
 
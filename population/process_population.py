@@ -1,22 +1,22 @@
 import os
 import json
-import csv
+import hashlib
 import numpy as np
 from scipy.ndimage.morphology import distance_transform_edt
 from collections import OrderedDict
 import matplotlib as mpl
 import matplotlib.pyplot as plt
-import pint
 import pandas
 import geopandas
 from affine import Affine
 import rasterio
-from rasterio.features import rasterize
 from rasterio.warp import transform_bounds, calculate_default_transform, reproject, RESAMPLING
 from rasterstats import zonal_stats
-import shapely.geometry as sgeom
 import cartopy.crs as ccrs
 
+import gis
+from util import convert, makedirs
+
 
 def clip_pop_to_delta(env, target, source):
     delta = geopandas.read_file(str(source[0]))
@@ -25,10 +25,8 @@ def clip_pop_to_delta(env, target, source):
         kwargs = src.meta.copy()
         del kwargs['transform']
 
-        mask = rasterize(delta.loc[0, 'geometry'], default_value=1, fill=0, out_shape=src.shape, transform=src.affine, dtype=src.dtypes[0])
-        window = rasterio.get_data_window(mask, 0)
+        window, mask = gis.rasterize_in_window(delta.loc[0, 'geometry'], src)
         image = src.read(1, window=window)
-        mask = mask[slice(*window[0]), slice(*window[1])]
         image[mask==0] = src.nodata
 
         kwargs.update({
@@ -83,17 +81,16 @@ def pop_elevation_bins(env, target, source):
             dst_affine, dst_crs, srtm_raw_nodata, RESAMPLING.bilinear)
 
     good = np.logical_and(pop != pop_raw_nodata, srtm != srtm_raw_nodata)
-    pops = pandas.Series(name='Population', index=pandas.Index([], dtype='float'))
-    elevs = np.r_[np.arange(35+1, dtype='float'), np.inf]
-    for elev in elevs:
-        under = np.logical_and(good, srtm <= elev)
-        if under.sum() == 0: # no populated grid cells under this elev
-            pops[elev] = 0
-            continue
-        over = np.logical_and(good, srtm > elev)
-        frac_under = under.sum() / float(good.sum())
-        pops[elev] = pop[under].mean() * frac_under * area_sqkm
-    pops.sort_index().to_pickle(str(target[0]))
+    # the inf edge is the delta total, which later steps rely on
+    elevs = np.union1d(np.asarray(env['elevs'], dtype='float'), [np.inf])
+    # bin each cell at the lowest elevation at or above it, then accumulate
+    # upwards so each elevation gets the population of cells at or below it,
+    # as a density over the whole delta
+    bins = np.searchsorted(elevs, srtm[good], side='left')
+    pop_under = np.cumsum(np.bincount(bins, weights=pop[good], minlength=elevs.size+1)[:elevs.size])
+    pops = pandas.Series(pop_under / float(max(good.sum(), 1)) * area_sqkm,
+                         name='Population', index=pandas.Index(elevs, dtype='float'))
+    pops.to_pickle(str(target[0]))
     return 0
 
 
@@ -156,19 +153,32 @@ def forecast_un_pop_elev(env, target, source):
     scenarios = pandas.CategoricalIndex(scenarios[1:], categories=scenarios[1:], ordered=True)
     multiindex = pandas.MultiIndex.from_product([delta_pops.columns, forecasts, scenarios],
                                                  names=['Delta','Forecast','Pop_Scenario'])
-    pop_elevs = pandas.DataFrame(index=delta_pops.index, columns=multiindex, dtype='float')
-    for delta, popelevs in delta_pops.iteritems():
-        for scenario in scenarios:
-            for forecast in forecasts:
-                growth = 0.0
-                for country, cdata in countries[delta].iteritems():
-                    iso = int(cdata['iso_num'])
-                    if popyear in futurepop['estimates']:
-                        cur_pop = futurepop['estimates'][popyear][iso]
-                    else:
-                        cur_pop = futurepop[scenarios[2]][popyear][iso] # scenarios[2] is "medium"
-                    growth += futurepop[scenario][forecast][iso] / cur_pop * cdata['area_frac']
-                pop_elevs[delta, forecast, scenario] = popelevs * growth
+
+    # delta x country area fractions
+    isos = sorted(set(int(cdata['iso_num']) for delta in delta_pops.columns
+                                            for cdata in countries[delta].values()))
+    country_col = dict((iso, i) for i, iso in enumerate(isos))
+    area_fracs = np.zeros((len(delta_pops.columns), len(isos)))
+    for i, delta in enumerate(delta_pops.columns):
+        for country, cdata in countries[delta].iteritems():
+            area_fracs[i, country_col[int(cdata['iso_num'])]] += cdata['area_frac']
+
+    # country x (forecast, scenario) growth relative to popyear
+    if popyear in futurepop['estimates']:
+        cur_pop = futurepop['estimates'].loc[isos, popyear]
+    else:
+        cur_pop = futurepop[scenarios[2]].loc[isos, popyear] # scenarios[2] is "medium"
+    cur_pop = np.asarray(cur_pop, dtype='float')
+    growth = np.empty((len(isos), len(forecasts), len(scenarios)))
+    for k, scenario in enumerate(scenarios):
+        growth[:, :, k] = np.asarray(futurepop[scenario].loc[isos, forecasts], dtype='float') / cur_pop[:, np.newaxis]
+
+    # delta growth, applied to each delta's whole hypsometric curve
+    delta_growth = area_fracs.dot(growth.reshape(len(isos), -1))
+    pop_elevs = (delta_pops.values.astype('float')[:, :, np.newaxis] *
+                 delta_growth[np.newaxis, :, :])
+    pop_elevs = pandas.DataFrame(pop_elevs.reshape(len(delta_pops.index), -1),
+                                 index=delta_pops.index, columns=multiindex)
     pop_elevs.to_pickle(str(target[0]))
     return 0
 
@@ -200,35 +210,43 @@ def forecast_ssp_pop_elev(env, source, target):
 
 
 def adjust_hypso_for_rslr(env, source, target):
-    Q_ = pint.UnitRegistry().Quantity
-
     pop_elevs = pandas.read_pickle(str(source[0]))
     rslrs = pandas.read_pickle(str(source[1]))
     elevyear = env['elevyear']
 
-    target_elevs = pop_elevs.index.tolist()
-    target_elevs.remove(np.inf)
-    new_interval = .1
-    target_elevs = np.arange(0, max(target_elevs)+new_interval, new_interval)
-    adj_pop = pandas.DataFrame(index=target_elevs, columns=pop_elevs.columns, dtype='float')
-
-    for (delta, forecast), _ in pop_elevs.groupby(level=['Delta', 'Forecast'], axis=1):
-        years = Q_(forecast - elevyear, 'year')
-        rslr = Q_(rslrs[delta], 'mm/year')
-        rise = rslr * years
-
-        new_elevs = (Q_(target_elevs, 'm') - rise).to('m').magnitude
-        all_elevs = np.sort(list(set(np.r_[new_elevs, target_elevs])))
-
-        pops = pop_elevs[delta, forecast].loc[target_elevs]
-        pops.index = new_elevs # old values but now at adjusted elevations
-        pops = pops.reindex(all_elevs) # add original elevations back into index (0,1,2,...) now with nans
-        pops = pops.interpolate('index') # cubic causes large swings near 0 and some negative populations, 'index' is piecewise linear using index values for spacing
-        pops[pops<0] = 0
-        pops = pops.fillna(method='backfill').fillna(method='pad') # fill any nans at new lowest or highest elevations that couldn't be interpolated
-        pops = pops.reindex(target_elevs) # drop new_elevs, keeping only whole elevations (0,1,2,...)
-
-        adj_pop[delta, forecast] = pops
+    # a tenth of the finest original interval. edges off that grid are
+    # added to it, so every original edge is used
+    elevs = np.asarray(pop_elevs.index.drop(np.inf), dtype=float)
+    new_interval = np.diff(elevs).min() / 10.
+    target_elevs = np.arange(elevs[0], elevs[-1]+new_interval, new_interval)
+    tol = new_interval * 1e-6
+    off_grid = np.abs(target_elevs[:, np.newaxis] - elevs).min(axis=0) > tol
+    target_elevs = np.union1d(target_elevs, elevs[off_grid])
+
+    # populations at target elevations that are original edges (up to the
+    # rounding of the grid), nan at the others
+    dist = np.abs(target_elevs[:, np.newaxis] - elevs)
+    rows = np.where(dist.min(axis=1) <= tol, dist.argmin(axis=1), -1)
+    pops = np.where((rows >= 0)[:, np.newaxis], pop_elevs.values.astype(float)[rows], np.nan)
+
+    # each column's curve moves down by its delta's rslr since elevyear
+    deltas = pop_elevs.columns.get_level_values('Delta')
+    years = np.asarray(pop_elevs.columns.get_level_values('Forecast')) - elevyear
+    rise = convert(rslrs.loc[deltas].values * years, 'mm', 'm')
+    new_elevs = target_elevs[:, np.newaxis] - rise[np.newaxis, :]
+
+    # old values now at adjusted elevations, piecewise linear in elevation
+    # between them (cubic causes large swings near 0 and some negative
+    # populations), held constant past the lowest and highest
+    adj = np.empty_like(pops)
+    for col in range(pops.shape[1]):
+        valid = ~np.isnan(pops[:, col])
+        if valid.any():
+            adj[:, col] = np.interp(target_elevs, new_elevs[valid, col], pops[valid, col])
+        else:
+            adj[:, col] = np.nan
+    adj[adj < 0] = 0
+    adj_pop = pandas.DataFrame(adj, index=target_elevs, columns=pop_elevs.columns)
 
     adj_pop.to_pickle(str(target[0]))
     return 0
@@ -252,6 +270,29 @@ def apply_hypso_curve_to_ssp_pops(env, source, target):
     return 0
 
 
+def read_ssp_csv(path, affine, shape, nyears, scaling, chunksize=100000):
+    '''
+    Grid a Murakami SSP csv (id, lon, lat, ..., one column per forecast year)
+    onto the raster described by affine and shape, converting from totals
+    per 0.5 degree cell to densities per sqkm.  Read in chunks of typed
+    columns; cells without data are -1.
+    '''
+    orig_affine = Affine(0.5, 0, -180, 0, -0.5, 90)
+    orig_data_areas = gis.lat_band_areas(np.linspace(90, -90, 180*2 + 1), 0.5) # km2
+
+    columns = pandas.read_csv(path, nrows=0).columns
+    dtypes = dict((col, np.float64) for col in columns[[1, 2]].tolist() + columns[4:].tolist())
+    data = np.ones(shape + (nyears,)) * -1
+    for chunk in pandas.read_csv(path, usecols=dtypes.keys(), dtype=dtypes,
+                                 float_precision='round_trip', chunksize=chunksize):
+        lon_lat = (chunk[columns[1]].values, chunk[columns[2]].values)
+        x, y = [np.floor(v).astype(np.int64) for v in ~affine * lon_lat]
+        orig_y = np.floor((~orig_affine * lon_lat)[1]).astype(np.int64)
+        values = chunk[columns[4:]].values
+        data[y, x, :] = values * scaling / orig_data_areas[orig_y][:, np.newaxis] # convert from millions of people to people/sqkm (or $)
+    return data
+
+
 def rasterize_ssp_data(env, source, target):
     with rasterio.open(str(source[0]), 'r') as basins_rast:
         basins = basins_rast.read(1)
@@ -260,28 +301,30 @@ def rasterize_ssp_data(env, source, target):
     basinids = pandas.read_pickle(str(source[1]))
     ssp_years = env['ssp_years']
     scaling = env['scaling']
-    orig_data_shape = (180*2, 360*2) #.5 x .5 degree raster
-    orig_data_lats = np.linspace(90, -90, orig_data_shape[0], endpoint=False)
-    orig_affine = Affine(0.5, 0, -180, 0, -0.5, 90)
-    dy = -.5
-    pc = ccrs.PlateCarree()
-    orig_data_areas = []
-    for lat in orig_data_lats:
-        laea = ccrs.LambertAzimuthalEqualArea(0.25, lat+dy/2.)
-        p = sgeom.Polygon([(0, lat), (0, lat+dy), (.5, lat+dy), (.5, lat), (0, lat)])
-        ps = laea.project_geometry(p, src_crs=pc)
-        orig_data_areas.append(ps.area / (1000**2)) # m2 to km2
-
-    data = np.ones(basins.shape + (len(ssp_years),)) * -1
-    to_floor_int = lambda s: int(np.floor(s))
-    with open(str(source[2]), 'r') as csvfile:
-        ssp_data = csv.reader(csvfile)
-        next(ssp_data)
-        for pixel in ssp_data:
-            lon_lat = (float(pixel[1]), float(pixel[2]))
-            x, y = map(to_floor_int, ~affine * lon_lat) # lon, lat
-            _, orig_y = map(to_floor_int, ~orig_affine * lon_lat)
-            data[y, x, :] = np.array(map(float, pixel[4:])) * scaling / orig_data_areas[orig_y] # convert from millions of people to people/sqkm (or $)
+
+    # gridded csv values are cached by csv checksum, grid and scaling, so
+    # reruns skip parsing
+    md5 = hashlib.md5()
+    with open(str(source[2]), 'rb') as csvfile:
+        for block in iter(lambda: csvfile.read(2**20), b''):
+            md5.update(block)
+    md5.update(repr((tuple(affine), basins.shape, len(ssp_years), scaling)))
+    cache = os.path.join(env['cache_dir'], md5.hexdigest() + '.tif')
+    if os.path.exists(cache):
+        with rasterio.open(cache, 'r') as cached:
+            data = np.rollaxis(cached.read(), 0, 3)
+    else:
+        data = read_ssp_csv(str(source[2]), affine, basins.shape, len(ssp_years), scaling)
+        makedirs(env['cache_dir'])
+        cache_profile = profile.copy()
+        cache_profile.update(count=len(ssp_years), dtype=data.dtype, nodata=-1)
+        # write then rename, so an interrupted or concurrent write never
+        # leaves a partial file at the cache path
+        tmp = '{}.{}.tmp.tif'.format(cache[:-4], os.getpid())
+        with rasterio.open(tmp, 'w', **cache_profile) as out:
+            out.write(np.rollaxis(data, 2))
+        os.rename(tmp, cache)
+
     mask = (data == -1)
     indices = distance_transform_edt(mask[...,0], return_distances=False, return_indices=True)
     data = data[tuple(indices)]
@@ -323,12 +366,32 @@ def extract_delta_ssp_vals(env, source, target):
         dst_affine, dst_width, dst_height = calculate_default_transform(
                 ssp_raw_crs, proj.proj4_params, x2-x1, y1-y2,
                 *bounds)
+
+        # source window covering everything the projected grid samples: the
+        # projected grid's bounds mapped back to lat/lon (not just the delta
+        # bounds, since the grid's corners reach past them), padded for the
+        # bilinear kernel
+        dst_bounds = (dst_affine.c, dst_affine.f + dst_affine.e * dst_height,
+                      dst_affine.c + dst_affine.a * dst_width, dst_affine.f)
+        src_lon1, src_lat1, src_lon2, src_lat2 = transform_bounds(
+                proj.proj4_params, ssp_raw_crs, *dst_bounds)
+        pad = 4
+        col1, row2 = map(lambda x: int(np.floor(x)) - pad, ~ssp_raw_affine * (src_lon1, src_lat2))
+        col2, row1 = map(lambda x: int(np.ceil(x)) + pad, ~ssp_raw_affine * (src_lon2, src_lat1))
+        col1, row2 = max(col1, 0), max(row2, 0)
+        col2, row1 = min(col2, ssp_raw_width), min(row1, ssp_raw_height)
+        window_affine = ssp_raw_affine * Affine.translation(col1, row2)
+
         for i, ssp in enumerate(env['ssp_names']):
-            for j, forecast in enumerate(env['ssp_years']):
-                delta_ssp = ssps[ssp][j,y2:y1,x1:x2] # lats inverted
-                ssp_proj = np.ones((dst_height, dst_width), dtype=rasterio.float64)
-                reproject(ssps[ssp][j,...], ssp_proj, ssp_raw_affine, ssp_raw_crs, ssp_raw_nodata,
+            # each forecast year warped from the window on its own. a single
+            # multi-band warp would share one nodata mask between the bands
+            ssp_window = ssps[ssp][:len(env['ssp_years']), row2:row1, col1:col2] # lats inverted
+            ssp_projs = np.ones((len(env['ssp_years']), dst_height, dst_width), dtype=rasterio.float64)
+            for j in range(len(env['ssp_years'])):
+                reproject(np.ascontiguousarray(ssp_window[j]), ssp_projs[j], window_affine, ssp_raw_crs, ssp_raw_nodata,
                     dst_affine, proj.proj4_params, ssp_raw_nodata, RESAMPLING.bilinear)
+            for j, forecast in enumerate(env['ssp_years']):
+                ssp_proj = ssp_projs[j]
                 stats = zonal_stats(delta_proj.loc[delta,'geometry'], ssp_proj, affine=dst_affine, nodata=ssp_raw_nodata)
                 counts = 0
                 means = 0
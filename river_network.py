@@ -0,0 +1,253 @@
+import numpy as np
+import scipy.sparse
+from collections import namedtuple, OrderedDict
+
+
+# River network of a single basin as flat arrays over its nodes (grid cells).
+# x, y are raster column/row of each node, down the local index of the node it
+# drains to (-1 at outlets), order a topological order (upstream nodes before
+# the nodes they drain to), depth the number of hops from each node to its
+# outlet, and mouth the outlet draining the most nodes
+Network = namedtuple('Network', ['x', 'y', 'down', 'order', 'depth', 'mouth'])
+
+# RGIS ToCell flow direction codes to (dx, dy)
+D8_NEIGHBORS = {
+        1: (1, 0),
+        2: (1, 1),
+        4: (0, 1),
+        8: (-1, 1),
+        16: (-1, 0),
+        32: (-1, -1),
+        64: (0, -1),
+        128: (1, -1),
+        }
+D8_VALID = np.zeros(256, dtype=bool)
+D8_DX = np.zeros(256, dtype=np.int64)
+D8_DY = np.zeros(256, dtype=np.int64)
+for code, (dx, dy) in D8_NEIGHBORS.items():
+    D8_VALID[code] = True
+    D8_DX[code] = dx
+    D8_DY[code] = dy
+
+
+def decode_flowdir(flowdir, pixels):
+    '''
+    Flat (row-major) offset of the cell each of pixels (flat offsets into a
+    D8 flow direction grid) drains to, or -1 where the code is not a
+    direction or points off the top or bottom of the grid.  Columns wrap
+    around at the dateline.
+    '''
+    height, width = flowdir.shape
+    y, x = np.unravel_index(pixels, flowdir.shape)
+    tocell = np.asarray(flowdir).ravel()[pixels].astype(np.int64)
+    valid = np.logical_and(tocell > 0, tocell < D8_VALID.size)
+    tocell[~valid] = 0
+    valid = D8_VALID[tocell]
+
+    down_x = (x + D8_DX[tocell]) % width
+    down_y = y + D8_DY[tocell]
+    valid &= np.logical_and(down_y >= 0, down_y < height)
+    return np.where(valid, down_y * width + down_x, -1)
+
+
+def build_network(pixels, flowdir):
+    '''
+    Network of a basin from the sorted flat raster offsets of its pixels and
+    the flow direction grid.  Cells draining to a cell outside the basin are
+    outlets.
+    '''
+    y, x = np.unravel_index(pixels, flowdir.shape)
+    down_flat = decode_flowdir(flowdir, pixels)
+    pos = np.searchsorted(pixels, down_flat)
+    pos[pos == pixels.size] = 0
+    inbasin = np.logical_and(down_flat >= 0, pixels[pos] == down_flat)
+    down = np.where(inbasin, pos, -1)
+
+    order, depth = topological_order(down)
+    outlets = np.flatnonzero(down < 0)
+    drainage = accumulate(down, order, depth, np.ones(down.size))
+    mouth = outlets[np.argmax(drainage[outlets])]
+    return Network(x.astype(np.int32), y.astype(np.int32), down.astype(np.int32),
+                   order.astype(np.int32), depth.astype(np.int32), int(mouth))
+
+
+def upstream_csr(down):
+    '''
+    Upstream neighbours of every node in CSR layout: the nodes draining
+    directly into node i are up_nodes[up_ptr[i]:up_ptr[i+1]]
+    '''
+    down = np.asarray(down)
+    has_down = np.flatnonzero(down >= 0)
+    up_nodes = has_down[np.argsort(down[has_down], kind='mergesort')]
+    up_ptr = np.r_[0, np.cumsum(np.bincount(down[has_down], minlength=down.size))]
+    return up_ptr, up_nodes
+
+
+def upstream_of(up_ptr, up_nodes, nodes):
+    '''All nodes draining directly into any of nodes'''
+    starts = up_ptr[nodes]
+    counts = up_ptr[np.asarray(nodes) + 1] - starts
+    offsets = (np.repeat(starts - np.cumsum(counts) + counts, counts) +
+               np.arange(counts.sum()))
+    return up_nodes[offsets]
+
+
+def topological_order(down):
+    '''
+    Order nodes by decreasing number of hops to their outlet, so every node
+    comes before the node it drains to.  Returns (order, depth).
+    '''
+    up_ptr, up_nodes = upstream_csr(down)
+    depth = np.empty(len(down), dtype=np.int64)
+    levels = []
+    level = np.flatnonzero(np.asarray(down) < 0)
+    while level.size:
+        depth[level] = len(levels)
+        levels.append(level)
+        level = upstream_of(up_ptr, up_nodes, level)
+    if sum(l.size for l in levels) != len(down):
+        raise ValueError('flow network has cycles')
+    order = np.concatenate(levels[::-1]) if levels else np.array([], dtype=np.int64)
+    return order, depth
+
+
+def levels(order, depth):
+    '''Split a topological order into groups of equal depth, deepest first'''
+    return np.split(order, np.flatnonzero(np.diff(depth[order])) + 1)
+
+
+def accumulate(down, order, depth, values):
+    '''
+    Sum of values over each node and everything upstream of it, sweeping one
+    depth level at a time from the headwaters down
+    '''
+    acc = np.array(values, dtype=np.float64)
+    for level in levels(order, depth)[:-1]:
+        np.add.at(acc, down[level], acc[level])
+    return acc
+
+
+def downstream_chains(down, dist):
+    '''
+    Each node followed by the nodes up to dist hops downstream of it, one
+    row per node, padded with -1 past the outlet
+    '''
+    down = np.asarray(down)
+    chains = np.empty((down.size, dist + 1), dtype=np.int64)
+    chains[:, 0] = np.arange(down.size)
+    for k in range(1, dist + 1):
+        prev = chains[:, k-1]
+        chains[:, k] = np.where(prev >= 0, down[np.maximum(prev, 0)], -1)
+    return chains
+
+
+def upstream_matrix(net, dist):
+    '''
+    Sparse CSR matrix A with A[i,j] = 1 when node j is within dist hops
+    upstream of node i (including i itself), so A.dot(values) sums values
+    over each node's upstream neighbourhood
+    '''
+    chains = downstream_chains(net.down, dist)
+    cols = np.repeat(np.arange(net.x.size), dist + 1)
+    rows = chains.ravel()
+    valid = rows >= 0
+    return scipy.sparse.csr_matrix(
+            (np.ones(valid.sum()), (rows[valid], cols[valid])),
+            shape=(net.x.size, net.x.size))
+
+
+def merge_networks(nets):
+    '''
+    Concatenate networks into a single network over all their nodes, so
+    sweeps can process every basin together.  Returns the merged network,
+    whose mouth is an array with one outlet per basin, and the node offsets
+    of each basin.
+    '''
+    nets = list(nets)
+    indptr = np.r_[0, np.cumsum([net.x.size for net in nets])]
+    offsets = indptr[:-1]
+    down = np.concatenate([np.where(net.down >= 0, net.down + offset, -1)
+                           for net, offset in zip(nets, offsets)])
+    depth = np.concatenate([net.depth for net in nets])
+    order = np.argsort(-depth, kind='mergesort')
+    mouth = np.array([net.mouth for net in nets]) + offsets
+    merged = Network(np.concatenate([net.x for net in nets]),
+                     np.concatenate([net.y for net in nets]),
+                     down, order, depth, mouth)
+    return merged, indptr
+
+
+def to_networkx(net):
+    '''networkx DiGraph with (x, y) node labels, for plotting'''
+    import networkx as nx
+    G = nx.DiGraph()
+    nodes = list(zip(net.x.tolist(), net.y.tolist()))
+    G.add_nodes_from(nodes)
+    G.add_edges_from((nodes[i], nodes[j]) for i, j in enumerate(net.down) if j >= 0)
+    return G
+
+
+def save_networks(path, nets):
+    '''Save an OrderedDict of {(delta, basinid): Network} as flat arrays'''
+    keys = list(nets.keys())
+    sizes = [nets[k].x.size for k in keys]
+    np.savez(path,
+             deltas=np.array([d for d, _ in keys]),
+             basinids=np.array([b for _, b in keys]),
+             indptr=np.r_[0, np.cumsum(sizes)],
+             mouths=np.array([nets[k].mouth for k in keys]),
+             **{field: np.concatenate([getattr(nets[k], field) for k in keys])
+                for field in ['x', 'y', 'down', 'order', 'depth']})
+    return 0
+
+
+def load_networks(path):
+    '''Load networks saved by save_networks, as views into the stored arrays'''
+    npz = np.load(path)
+    data = dict((k, npz[k]) for k in npz.files)
+    npz.close()
+    indptr = data['indptr']
+    nets = OrderedDict()
+    for i, (delta, basinid) in enumerate(zip(data['deltas'], data['basinids'])):
+        s = slice(indptr[i], indptr[i+1])
+        nets[(str(delta), int(basinid))] = Network(
+                data['x'][s], data['y'][s], data['down'][s],
+                data['order'][s], data['depth'][s], int(data['mouths'][i]))
+    return nets
+
+
+def save_upstream_matrices(path, mats):
+    '''
+    Save an OrderedDict of {(delta, basinid): csr_matrix} as one
+    block-diagonal matrix of ones
+    '''
+    keys = list(mats.keys())
+    sizes = [mats[k].shape[0] for k in keys]
+    offsets = np.r_[0, np.cumsum(sizes)]
+    nnz = np.r_[0, np.cumsum([mats[k].nnz for k in keys])]
+    np.savez(path,
+             deltas=np.array([d for d, _ in keys]),
+             basinids=np.array([b for _, b in keys]),
+             offsets=offsets,
+             indptr=np.r_[0, np.concatenate([mats[k].indptr[1:] + nnz[i]
+                                             for i, k in enumerate(keys)])],
+             indices=np.concatenate([mats[k].indices + offsets[i]
+                                     for i, k in enumerate(keys)]))
+    return 0
+
+
+def load_upstream_matrices(path):
+    '''Load matrices saved by save_upstream_matrices'''
+    npz = np.load(path)
+    data = dict((k, npz[k]) for k in npz.files)
+    npz.close()
+    offsets, indptr, indices = data['offsets'], data['indptr'], data['indices']
+    mats = OrderedDict()
+    for i, (delta, basinid) in enumerate(zip(data['deltas'], data['basinids'])):
+        start, stop = offsets[i], offsets[i+1]
+        ptr = indptr[start:stop+1]
+        mats[(str(delta), int(basinid))] = scipy.sparse.csr_matrix(
+                (np.ones(ptr[-1] - ptr[0]), indices[ptr[0]:ptr[-1]] - start,
+                 ptr - ptr[0]),
+                shape=(stop - start, stop - start))
+    return mats
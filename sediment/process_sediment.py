@@ -4,22 +4,21 @@ import matplotlib as mpl
 import matplotlib.pyplot as plt
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 import itertools
+import heapq
 import pandas
 import rasterio
 import fiona
-import pint
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
 from collections import OrderedDict
 import networkx as nx
 
-from util import in_new_process, getLogger
+from util import in_new_process, getLogger, convert
+import basin_index as bi
+import river_network as rn
 
 
 def rasterize_grand_dams(env, target, source):
-    ureg = pint.UnitRegistry()
-    Q_ = ureg.Quantity
-
     with rasterio.open(str(source[1]), 'r') as basins_rast:
         basins = basins_rast.read(1)
         meta = basins_rast.meta.copy()
@@ -32,7 +31,7 @@ def rasterize_grand_dams(env, target, source):
                     (props['CAP_MCM'] > 0)):
                 lon = props['LONG_DD']
                 lat = props['LAT_DD']
-                vol = Q_(1e6 * props['CAP_MCM'], 'm**3').to('km**3').magnitude
+                vol = convert(1e6 * props['CAP_MCM'], 'm**3', 'km**3')
                 x, y = map(np.floor, ~affine * (lon, lat))
                 resvol[y, x] += vol
 
@@ -49,24 +48,21 @@ def compute_I(env, target, source):
 
 
 def res_trapping_bulk(env, target, source):
-    ureg = pint.UnitRegistry()
-    Q_ = ureg.Quantity
-
     utilization = 0.67
     with rasterio.open(str(source[0]), 'r') as resrast,\
-             rasterio.open(str(source[1]), 'r') as disrast,\
-             rasterio.open(str(source[2]), 'r') as basinrast:
+             rasterio.open(str(source[1]), 'r') as disrast:
         kwargs = resrast.meta.copy()
-        resvol = Q_(resrast.read(1, masked=True), 'km**3').to('m**3').magnitude * utilization
-        dis = Q_(disrast.read(1, masked=True), 'm**3/s').to('m**3/year').magnitude
-        basins = basinrast.read(1, masked=True)
+        resvol = convert(resrast.read(1, masked=True), 'km**3', 'm**3') * utilization
+        dis = convert(disrast.read(1, masked=True), 'm**3/s', 'm**3/year')
+    index = bi.load_pixel_index(str(source[2]))
     resvol.mask[resvol==0] = True
     basin_ids = pandas.read_pickle(str(source[3]))
 
     Te = []
     for delta, basin_id in basin_ids.index:
-        pix = np.logical_and(basins == basin_id, resvol>0)
-        res_time = resvol[pix].sum() / dis[basins==basin_id].max()
+        pix = bi.basin_rowcol(index, basin_id)
+        basin_resvol = resvol[pix]
+        res_time = basin_resvol[basin_resvol>0].sum() / dis[pix].max()
         Te.append(1 - (0.05/np.sqrt(res_time)))
     Te = [te if (te is not np.ma.masked and te >= 0) else 0 for te in Te]
 
@@ -76,48 +72,41 @@ def res_trapping_bulk(env, target, source):
 
 
 def res_trapping_subbasins(env, target, source):
-    ureg = pint.UnitRegistry()
-    Q_ = ureg.Quantity
-
     with rasterio.open(str(source[0]), 'r') as rast:
         resvol = rast.read(1)
     with rasterio.open(str(source[1]), 'r') as rast:
         dis = rast.read(1)
-    with rasterio.open(str(source[2]), 'r') as rast:
-        basins = rast.read(1)
-    networks = pandas.read_pickle(str(source[3]))
-
-    logger = getLogger(target)
+    networks = rn.load_networks(str(source[2]))
 
     utilization = 0.67
-    resvol = utilization * Q_(resvol, 'km**3').to('m**3').magnitude
+    resvol = utilization * convert(resvol, 'km**3', 'm**3')
     resvol[resvol<0] = 0
-    dis = Q_(dis, 'm**3/s').to('m**3/year').magnitude
-
-    TE = pandas.Series(0.0, index=networks.index)
-    for (delta, basinid), G in list(networks.iteritems()):
-        logger.info('{0} - {1}'.format(delta, basinid))
-        topo_sort = nx.topological_sort(G)
-        for node in topo_sort:
-            G.node[node]['resvol'] = resvol[node[1], node[0]]
-            G.node[node]['resvol_agg'] = resvol[node[1], node[0]] + sum([G.node[n]['resvol_agg'] for n in G.predecessors(node)])
-
-        mouth = topo_sort[-1]
-        tes = []
-        diss = []
-        to_visit = [mouth]
-        while to_visit:
-            node = to_visit.pop(0)
-            if resvol[node[1], node[0]] > 0:
-                localdis = dis[node[1], node[0]]
-                if localdis > 0:
-                    dt = G.node[node]['resvol_agg'] / localdis
-                    te = max(1 - (0.05 / np.sqrt(dt)), 0)
-                    tes.append(te)
-                    diss.append(localdis)
-            else:
-                to_visit.extend(G.predecessors(node))
-        TE[(delta, basinid)] = sum([t*d for t,d in zip(tes, diss)]) / dis[basins==basinid].max()
+    dis = convert(dis, 'm**3/s', 'm**3/year')
+
+    net, indptr = rn.merge_networks(networks.values())
+    basin = np.repeat(np.arange(len(networks)), np.diff(indptr))
+    node_resvol = resvol[net.y, net.x]
+    node_dis = dis[net.y, net.x]
+    hasres = node_resvol > 0
+
+    # reservoir volume upstream of each node, all basins in one sweep
+    resvol_agg = rn.accumulate(net.down, net.order, net.depth, node_resvol)
+
+    # walking up from each mouth, a node is reached if no reservoir lies
+    # between it and the mouth; reached reservoirs are the first ones
+    reached = np.zeros(net.x.size, dtype=bool)
+    reached[net.mouth] = True
+    for level in rn.levels(net.order, net.depth)[-2::-1]:
+        down = net.down[level]
+        reached[level] = np.logical_and(reached[down], ~hasres[down])
+    first = reached & hasres & (node_dis > 0)
+
+    te = np.maximum(1 - (0.05 / np.sqrt(resvol_agg[first] / node_dis[first])), 0)
+    trapped = np.bincount(basin[first], weights=te * node_dis[first],
+                          minlength=len(networks))
+    TE = pandas.Series(trapped / np.maximum.reduceat(node_dis, indptr[:-1]),
+                       index=pandas.MultiIndex.from_tuples(
+                           list(networks.keys()), names=['Delta', 'BasinID']))
 
     TE.to_pickle(str(target[0]))
     return 0
@@ -176,11 +165,11 @@ def add_new_reservoirs(env, target, source):
     with rasterio.open(str(source[2])) as dissrc:
         dis = dissrc.read(1)
 
-    with rasterio.open(str(source[3])) as basinsrc:
-        basins = basinsrc.read(1)
-
+    index = bi.load_pixel_index(str(source[3]))
     basinids = pandas.read_pickle(str(source[4]))
 
+    logger = getLogger(target)
+
     def dis_class_endmembers(s):
         return map(float, s.replace('>','').split('-'))
 
@@ -203,18 +192,27 @@ def add_new_reservoirs(env, target, source):
     for delta, deltabasins in basinids.groupby(level='Delta'):
         if delta not in res_adj.index:
             continue
-        mask = np.ones_like(res)
-        for _, basinid in deltabasins.index:
-            mask = np.logical_and(mask, basins!=basinid)
-        mask[res>0] = True   # mark existing reservoirs
+        # candidate cells in raster order, skipping existing reservoirs
+        cands = np.sort(np.concatenate([bi.basin_pixels(index, basinid)
+                                        for _, basinid in deltabasins.index]))
+        cands = cands[~(res.ravel()[cands] > 0)]
+        taken = np.zeros(cands.size, dtype=bool)
         # loop over discharge classes in reverse order so biggest dams get placed first. not necessary unless very few valid locs
         for (dis_class, res_in_class) in reversed(list(res_adj.groupby(axis=1, level='Discharge class', sort=True))):
             num_new_res = res_in_class.loc[delta, (dis_class, 'new')]
-            for i in range(num_new_res):
-                valid_dis = np.ma.masked_where(mask, dis)
-                new_loc = np.unravel_index(np.argmin(np.abs(valid_dis - dis_class_mean(dis_class))), dis.shape)
-                res[new_loc] = new_vols.loc[dis_class]
-                mask[new_loc] = True
+            if num_new_res == 0:
+                continue
+            # rank candidates by distance from class mean once, stable so
+            # ties go to the first cell in raster order
+            dis_diff = np.abs(dis.ravel()[cands] - dis_class_mean(dis_class))
+            ranked = np.argsort(dis_diff, kind='mergesort')
+            ranked = ranked[~taken[ranked]]
+            if ranked.size < num_new_res:
+                logger.warning('{0}: only {1} locations left for {2} dams in class {3}'.format(
+                    delta, ranked.size, num_new_res, dis_class))
+            new_locs = ranked[:num_new_res]
+            res[np.unravel_index(cands[new_locs], res.shape)] = new_vols.loc[dis_class]
+            taken[new_locs] = True
 
     with rasterio.open(str(target[0]), 'w', **res_meta) as resout:
         resout.write(res, 1)
@@ -229,8 +227,7 @@ def calc_new_res_volumes(env, source, target):
         res = rast.read(1)
     potential = pandas.read_pickle(str(source[1]))
     utilization = pandas.read_pickle(str(source[2]))
-    with rasterio.open(str(source[3])) as rast:
-        basins = rast.read(1)
+    index = bi.load_pixel_index(str(source[3]))
     basinids = pandas.read_pickle(str(source[4]))
     method = env['method']
 
@@ -240,7 +237,8 @@ def calc_new_res_volumes(env, source, target):
         factor = method
         mean_res = res[res>0].mean()
         for delta, basinid in basinids.index:
-            res_vols = sorted(res[np.logical_and(basins==basinid, res>0)].tolist())
+            basin_res = res[bi.basin_rowcol(index, basinid)]
+            res_vols = sorted(basin_res[basin_res>0].tolist())
             if len(res_vols) == 0:
                 new_res_vols[(delta, basinid)] = []
                 continue
@@ -252,7 +250,8 @@ def calc_new_res_volumes(env, source, target):
         ref_util = utilization[ref_basin, ref_basinid]
         mean_res = res[res>0].mean()
         for delta, basinid in basinids.index:
-            res_vols = sorted(res[np.logical_and(basins==basinid, res>0)].tolist())
+            basin_res = res[bi.basin_rowcol(index, basinid)]
+            res_vols = sorted(basin_res[basin_res>0].tolist())
             target_vol = ref_util * potential[delta, basinid]
             if target_vol < sum(res_vols):
                 # handle seperately, don't add new res just shrink current ones
@@ -308,6 +307,63 @@ def calc_new_res_volumes_zarfl(env, source, target):
     return 0
 
 
+def place_reservoirs(net, upstream, node_potential, node_res, new_vols, agg_dist):
+    '''
+    Add each of new_vols to node_res in turn, at the node with the most
+    remaining potential within agg_dist hops upstream of it (upstream is the
+    basin's rn.upstream_matrix for agg_dist).  The potential of a node is
+    scaled down by the reservoir at the furthest node within agg_dist
+    downstream, so a new reservoir only changes the aggregates near it.
+    Those are recomputed in place and the best site kept in a heap;
+    everything is recomputed only when the largest reservoir changes.  Ties
+    go to the node earliest in topological order.  Remaining potentials are
+    float64 whatever the raster type, as in the original per-node sums.
+    '''
+    n = net.x.size
+    node_potential = np.asarray(node_potential, dtype=np.float64)
+    chains = rn.downstream_chains(net.down, agg_dist)
+    governor = chains[np.arange(n), (chains >= 0).sum(axis=1) - 1]
+    governed = np.argsort(governor, kind='mergesort')
+    gov_ptr = np.r_[0, np.cumsum(np.bincount(governor, minlength=n))]
+    rank = np.empty(n, dtype=np.int64)
+    rank[net.order] = np.arange(n)
+
+    def scale_remaining(remaining, cell, maxres):
+        nodes = governed[gov_ptr[cell]:gov_ptr[cell+1]]
+        remaining[nodes] = node_potential[nodes] * (1. - node_res[cell] / maxres)
+        return nodes
+
+    def setup_potentials(maxres):
+        remaining = node_potential.copy()
+        if maxres > 0:
+            for cell in np.flatnonzero(np.diff(gov_ptr)):
+                scale_remaining(remaining, cell, maxres)
+        rem_agg = upstream.dot(remaining)
+        heap = [(-v, rank[i], i) for i, v in enumerate(rem_agg)]
+        heapq.heapify(heap)
+        return remaining, rem_agg, heap
+
+    maxres = node_res.max()
+    remaining, rem_agg, heap = setup_potentials(maxres)
+    for new_res in new_vols:
+        # drop entries made stale by later updates
+        while -heap[0][0] != rem_agg[heap[0][2]]:
+            heapq.heappop(heap)
+        max_node = heap[0][2]
+        node_res[max_node] += new_res
+        if node_res[max_node] > maxres:
+            maxres = node_res[max_node]
+            remaining, rem_agg, heap = setup_potentials(maxres)
+        elif maxres > 0:
+            nodes = scale_remaining(remaining, max_node, maxres)
+            changed = np.unique(chains[nodes])
+            changed = changed[changed >= 0]
+            rem_agg[changed] = upstream[changed].dot(remaining)
+            for node in changed:
+                heapq.heappush(heap, (-rem_agg[node], rank[node], node))
+    return node_res
+
+
 @in_new_process
 def add_new_reservoirs_on_network(env, source, target):
     with rasterio.open(str(source[0]), 'r') as rast:
@@ -316,110 +372,69 @@ def add_new_reservoirs_on_network(env, source, target):
         res = rast.read(1)
     with rasterio.open(str(source[1]), 'r') as rast:
         potential = rast.read(1)
-    with rasterio.open(str(source[2]), 'r') as rast:
-        basins = rast.read(1)
-    new_res_vols = pandas.read_pickle(str(source[3]))
-    networks = pandas.read_pickle(str(source[4]))
+    new_res_vols = pandas.read_pickle(str(source[2]))
+    networks = rn.load_networks(str(source[3]))
+    upstream = rn.load_upstream_matrices(str(source[4]))
+    agg_dist = env['agg_dist']
 
     logger = getLogger(target)
 
     potential[potential<0] = 0
 
-    agg_dist = 3
-
-    def setup_potentials(G, Grev, topo_sorted, potential):
-        for node in topo_sorted:
-            upstream = nx.single_source_shortest_path(Grev, node, agg_dist).keys()
-            G.node[node]['potential'] = potential[node[1], node[0]]
-            G.node[node]['potential_remaining'] = potential[node[1], node[0]]
-            G.node[node]['potential_agg'] = sum([G.node[n]['potential'] for n in upstream])
-        return G
-
-    def update_potentials(G, Grev, topo_sorted, potential, res, maxres):
-        if maxres > 0:
-            for node in topo_sorted:
-                upstream = nx.single_source_shortest_path(Grev, node, agg_dist).keys()
-                factor = 1. - res[node[1],node[0]] / maxres
-                for n in upstream:
-                    G.node[n]['potential_remaining'] = G.node[n]['potential'] * factor
-        max_rem_agg = -1
-        for node in topo_sorted:
-            upstream = nx.single_source_shortest_path(Grev, node, agg_dist).keys()
-            G.node[node]['potential_rem_agg'] = sum([G.node[n]['potential_remaining'] for n in upstream])
-            if G.node[node]['potential_rem_agg'] > max_rem_agg:
-                max_rem_agg = G.node[node]['potential_rem_agg']
-                max_node = node
-        return G, max_node
-
-    for (delta, basinid), G in networks.iteritems():
+    for (delta, basinid), net in networks.iteritems():
         logger.info('{0} - {1}'.format(delta, basinid))
         if isinstance(new_res_vols[(delta, basinid)], float):
             if np.isfinite(new_res_vols[(delta, basinid)]):
                 # simple scaling factor
-                for node in G:
-                    res[node[1], node[0]] *= new_res_vols[(delta, basinid)]
+                res[net.y, net.x] *= new_res_vols[(delta, basinid)]
             # else nan, don't modify reservoirs for this basin
             continue
 
-        Grev = G.reverse()
-        topo_sorted = nx.topological_sort(G)
-
-        maxres = res[basins==basinid].max()
-        G = setup_potentials(G, Grev, topo_sorted, potential)
-        G, max_node = update_potentials(G, Grev, topo_sorted, potential, res, maxres)
-        for new_res in new_res_vols[(delta, basinid)]:
-            res[max_node[1], max_node[0]] += new_res
-            if res[max_node[1], max_node[0]] > maxres:
-                maxres = res[max_node[1], max_node[0]]
-            G, max_node = update_potentials(G, Grev, topo_sorted, potential, res, maxres)
+        res[net.y, net.x] = place_reservoirs(net, upstream[(delta, basinid)],
+                                             potential[net.y, net.x],
+                                             res[net.y, net.x],
+                                             new_res_vols[(delta, basinid)],
+                                             agg_dist)
 
     with rasterio.open(str(target[0]), 'w', **res_meta) as resout:
         resout.write(res, 1)
     return 0
 
 
-def draw_res_network(G, potential, res):
+def draw_res_network(net, upstream, potential, res):
 
-    def draw(G, pos, field, vmin=None, vmax=None):
+    def draw(G, pos, nodelist, field, vmin=None, vmax=None):
         import matplotlib as mpl
         import matplotlib.pyplot as plt
         mpl.style.use('ggplot')
         fig, ax = plt.subplots(1, 1, figsize=(12,8))
-        nx.draw_networkx(G, pos=pos, with_labels=False, node_size=80, node_color=field, cmap=mpl.cm.viridis, vmin=vmin, vmax=vmax, ax=ax)
+        nx.draw_networkx(G, pos=pos, nodelist=nodelist, with_labels=False, node_size=80, node_color=field, cmap=mpl.cm.viridis, vmin=vmin, vmax=vmax, ax=ax)
         plt.ion()
         plt.show()
 
-    def compute_potentials(G, potential, res):
-        Grev = G.reverse()
-        agg_dist = 3
-        pos = {}
-        maxres = np.max([res[n[1],n[0]] for n in G])
-        for node in nx.topological_sort(G):
-            upstream = nx.single_source_shortest_path(Grev, node, agg_dist).keys()
-            G.node[node]['potential'] = potential[node[1], node[0]]
-            G.node[node]['potential_remaining'] = potential[node[1], node[0]]
-            if (maxres > 0) and (res[node[1], node[0]] > 0):
-                factor = 1. - res[node[1],node[0]] / maxres
-                for n in upstream:
-                    G.node[n]['potential_remaining'] *= factor
-        for node in nx.topological_sort(G):
-            upstream = nx.single_source_shortest_path(Grev, node, agg_dist).keys()
-            G.node[node]['potential_agg'] = sum([G.node[n]['potential'] for n in upstream])
-            G.node[node]['potential_rem_agg'] = sum([G.node[n]['potential_remaining'] for n in upstream])
-            pos[node] = (node[0], -node[1])
-        return G, pos
-
-    G, pos = compute_potentials(G, potential, res)
-    nodes = G.nodes()
-    draw(G, pos, [res[n[1],n[0]] for n in nodes])
-    draw(G, pos, [G.node[n]['potential'] for n in nodes])
-    draw(G, pos, [G.node[n]['potential_agg'] for n in nodes])
-    draw(G, pos, [G.node[n]['potential_rem_agg'] for n in nodes])
+    def compute_potentials(net, upstream, potential, res):
+        node_res = res[net.y, net.x]
+        node_potential = potential[net.y, net.x]
+        remaining = node_potential.copy()
+        maxres = node_res.max()
+        if maxres > 0:
+            for node in np.flatnonzero(node_res > 0):
+                up = upstream.indices[upstream.indptr[node]:upstream.indptr[node+1]]
+                remaining[up] *= 1. - node_res[node] / maxres
+        potential_agg = upstream.dot(node_potential)
+        potential_rem_agg = upstream.dot(remaining)
+        return node_res, node_potential, potential_agg, potential_rem_agg
+
+    fields = compute_potentials(net, upstream, potential, res)
+    G = rn.to_networkx(net)
+    nodes = list(zip(net.x.tolist(), net.y.tolist()))
+    pos = dict((n, (n[0], -n[1])) for n in nodes)
+    for field in fields:
+        draw(G, pos, nodes, field)
 
 
 def compute_res_potential_and_utilization(env, source, target):
     with rasterio.open(str(source[0]), 'r') as rast:
-        basins = rast.read(1)
         meta = rast.meta
         meta['transform'] = meta['affine']
     with rasterio.open(str(source[1]), 'r') as rast:
@@ -429,6 +444,7 @@ def compute_res_potential_and_utilization(env, source, target):
     with rasterio.open(str(source[3]), 'r') as rast:
         res = rast.read(1)
     basinids = pandas.read_pickle(str(source[4]))
+    index = bi.load_pixel_index(str(source[5]))
 
     invalid = np.logical_or(relief<0, runoff<0)
     relief[relief < 0] = 0
@@ -438,8 +454,9 @@ def compute_res_potential_and_utilization(env, source, target):
     basin_potential = pandas.Series(index=basinids.index)
     basin_resvol = pandas.Series(index=basinids.index)
     for (delta, basinid) in basinids.index:
-        basin_potential[(delta, basinid)] = potential[basins==basinid].sum()
-        basin_resvol[(delta, basinid)] = res[basins==basinid].sum()
+        pix = bi.basin_rowcol(index, basinid)
+        basin_potential[(delta, basinid)] = potential[pix].sum()
+        basin_resvol[(delta, basinid)] = res[pix].sum()
     utilization = basin_resvol / basin_potential
     utilization[utilization.isnull()] = 0
 
@@ -474,8 +491,7 @@ def scale_reservoirs_by_utilization(env, source, target):
         res = rast.read(1)
         meta = rast.meta
         meta['transform'] = meta['affine']
-    with rasterio.open(str(source[1]), 'r') as rast:
-        basins = rast.read(1)
+    index = bi.load_pixel_index(str(source[1]))
     potential = pandas.read_pickle(str(source[2]))
     utilization = pandas.read_pickle(str(source[2]))
     ref_basin = env['ref_basin']
@@ -486,13 +502,14 @@ def scale_reservoirs_by_utilization(env, source, target):
     res_adj = np.zeros_like(res)
     for (delta, basinid) in potential.index:
         basin_utilization = utilization[(delta, basinid)]
+        pix = bi.basin_rowcol(index, basinid)
         if basin_utilization > 0:
             scaling = ref_utilization / basin_utilization
-            res_adj[basins==basinid] = res[basins==basinid] * scaling
+            res_adj[pix] = res[pix] * scaling
         else:
             # no reservoirs in this basin. add a single one of necessary size to some point in basin
             # other points already zero
-            y, x = zip(*np.where(basins==basinid))[0]
+            y, x = zip(*pix)[0]
             res_adj[y, x] = ref_utilization * potential[(delta, basinid)]
 
     utilization.to_pickle(str(target[0]))
@@ -513,15 +530,17 @@ def make_res_maps(env, source, target):
         basins = rast.read(1, masked=True)
         x1, y1, x2, y2 = rast.window_bounds(((0, rast.height), (0, rast.width)))
         extent = [x1, x2, y1, y2]
+    index = bi.load_pixel_index(str(source[4]))
 
     pot_basin_rast = np.zeros_like(basins)
     util_basin_rast = np.zeros_like(basins)
 
     # potential = potential.groupby(level='Delta').transform(np.sum)
     for (delta, basinid) in potential.index:
-        # if (basins==basinid).sum() > 20:
-        pot_basin_rast[basins==basinid] = np.log10(potential[(delta, basinid)])
-        util_basin_rast[basins==basinid] = np.log10(utilization[(delta, basinid)])
+        pix = bi.basin_rowcol(index, basinid)
+        # if len(pix[0]) > 20:
+        pot_basin_rast[pix] = np.log10(potential[(delta, basinid)])
+        util_basin_rast[pix] = np.log10(utilization[(delta, basinid)])
     pot_basin_rast[pot_basin_rast==0] = np.nan
     pot_basin_rast[~np.isfinite(pot_basin_rast)] = np.nan
     util_basin_rast[util_basin_rast==0] = np.nan
@@ -582,11 +601,8 @@ def compute_B(env, target, source):
 
 
 def compute_Qs(env, target, source):
-    ureg = pint.UnitRegistry()
-    Q_ = ureg.Quantity
-
     B = pandas.read_pickle(str(source[0]))
-    Q = Q_(pandas.read_pickle(str(source[1])), 'm**3/s').to('km**3/year').magnitude
+    Q = convert(pandas.read_pickle(str(source[1])), 'm**3/s', 'km**3/year')
     A = pandas.read_pickle(str(source[2]))
     R = pandas.read_pickle(str(source[3]))
     T = pandas.read_pickle(str(source[4]))
@@ -804,9 +820,6 @@ def plot_scalars_percent_change(env, target, source):
 
 def plot_rslr_timeseries(env, source, target):
     mpl.style.use('ggplot')
-    ureg = pint.UnitRegistry()
-    Q_ = ureg.Quantity
-
     scenarios = env['scenarios']
     deltas = env['deltas']
     slr_cur = env['slr_cur'] # 'mm/year'
@@ -3,12 +3,13 @@ import numpy as np
 import pandas
 import geopandas
 import rasterio
-from rasterio.features import rasterize
 from affine import Affine
 import shapely.geometry as sgeom
 import cartopy.crs as ccrs
 from cartopy.io.srtm import SRTM1Source, SRTM3Source, SRTMDownloader
 
+import gis
+
 def delta_srtm_composite(env, target, source):
     dname = env['delta']
     resolution=env['resolution']
@@ -53,10 +54,8 @@ def clip_srtm_to_delta(env, target, source):
         kwargs = src.meta.copy()
         del kwargs['transform']
 
-        mask = rasterize(delta.loc[0, 'geometry'], default_value=1, fill=0, out_shape=src.shape, transform=src.affine, dtype=src.dtypes[0])
-        window = rasterio.get_data_window(mask, 0)
+        window, mask = gis.rasterize_in_window(delta.loc[0, 'geometry'], src)
         image = src.read(1, window=window)
-        mask = mask[slice(*window[0]), slice(*window[1])]
         image[mask==0] = nodata
 
         kwargs.update({
@@ -4,7 +4,6 @@ import numpy as np
 import pandas
 import geopandas
 import fiona
-import pint
 import rasterio
 from rasterio.warp import transform_bounds, calculate_default_transform, reproject, RESAMPLING
 from rasterstats import zonal_stats
@@ -21,6 +20,8 @@ import statsmodels.formula.api as smf
 
 from cStringIO import StringIO
 
+from util import convert, unit_registry
+
 def import_rslr_lit(env, target, source):
     '''
     Import rslr estimates from literture source.  Lit sources are given by a
@@ -62,9 +63,6 @@ def import_rslr_lit(env, target, source):
 
 
 def import_accomodation_space(env, target, source):
-    ureg = pint.UnitRegistry()
-    Q_ = ureg.Quantity
-
     deltas = pandas.read_pickle(str(source[0]))
     space = pandas.Series(index=deltas.index)
     shape_factor = 0.5 #env['shape_factor']
@@ -73,9 +71,9 @@ def import_accomodation_space(env, target, source):
         for entry in reader:
             delta = entry['Delta']
             if delta in deltas:
-                area = Q_(float(entry['Ad, km2']), 'km**2')
-                depth = Q_(float(entry['Dsh, m']), 'm')
-                space[delta] = (shape_factor * area * depth).to('km**3').magnitude
+                area = float(entry['Ad, km2']) # km**2
+                depth = float(entry['Dsh, m']) # m
+                space[delta] = convert(shape_factor * area * depth, 'km**2*m', 'km**3')
     space[space.isnull()] = space.mean()
     space.to_pickle(str(target[0]))
     return 0
@@ -97,19 +95,14 @@ def import_sed_retention_ratio(env, target, source):
 
 
 def sed_aggradation(env, target, source):
-    ureg = pint.UnitRegistry()
-    Q_ = ureg.Quantity
-
-    area = Q_(pandas.read_pickle(str(source[0])),
-            'km**2')
-    Qs = Q_(pandas.read_pickle(str(source[1]))
+    area = pandas.read_pickle(str(source[0])) # km**2
+    Qs = (pandas.read_pickle(str(source[1])) # kg/s
             .groupby(level='Delta')
-            .sum(),
-            'kg/s')
+            .sum())
 
     # estimate from Blum and Roberts 2009, Nature GeoSci, mississippi value
-    # sed_density = Q_(1.5, 'g/cm**3') # g/cm**3, also in BT/km**3
-    sed_density = Q_(env['sed_dens'], 'g/cm**3')
+    # sed_density = 1.5 # g/cm**3, also in BT/km**3
+    sed_density = env['sed_dens'] # g/cm**3
     sed_porosity = env['sed_poro']
 
     # estimate from same paper, range of 30-70%. references Ganges values of 30%, and 39-71%.
@@ -120,71 +113,57 @@ def sed_aggradation(env, target, source):
     # biogenic sediment ??
 
     aggradation = ((Qs * retention_frac / sed_density) / (1.0 - sed_porosity)) / area
-    aggradation.to('mm/year').magnitude.to_pickle(str(target[0]))
+    convert(aggradation, 'kg/s/(g/cm**3)/km**2', 'mm/year').to_pickle(str(target[0]))
     return 0
 
 
 def sed_aggradation_variable_retention(env, target, source):
-    ureg = pint.UnitRegistry()
-    Q_ = ureg.Quantity
-
-    area = Q_(pandas.read_pickle(str(source[0])),
-            'km**2')
-    Qs = Q_(pandas.read_pickle(str(source[1]))
+    area = pandas.read_pickle(str(source[0])) # km**2
+    Qs = (pandas.read_pickle(str(source[1])) # kg/s
             .groupby(level='Delta')
-            .sum(),
-            'kg/s')
+            .sum())
     retention_frac = pandas.read_pickle(str(source[2]))
 
     # estimate from Blum and Roberts 2009, Nature GeoSci, mississippi value
-    sed_density = Q_(1.5, 'g/cm**3') # g/cm**3, also in BT/km**3
+    sed_density = 1.5 # g/cm**3, also in BT/km**3
     sed_porosity = env['sed_poro']
 
     # biogenic sediment ??
 
     aggradation = ((Qs * retention_frac / sed_density) / (1.0 - sed_porosity)) / area
-    aggradation.to('mm/year').magnitude.to_pickle(str(target[0]))
+    convert(aggradation, 'kg/s/(g/cm**3)/km**2', 'mm/year').to_pickle(str(target[0]))
     return 0
 
 
 def sed_aggradation_with_progradation(env, target, source):
-    ureg = pint.UnitRegistry()
-    Q_ = ureg.Quantity
-
-    area = Q_(pandas.read_pickle(str(source[0])),
-            'km**2')
-    Qs = Q_(pandas.read_pickle(str(source[1]))
+    area = pandas.read_pickle(str(source[0])) # km**2
+    Qs = (pandas.read_pickle(str(source[1])) # kg/s
             .groupby(level='Delta')
-            .sum(),
-            'kg/s')
+            .sum())
 
-    sed_density = Q_(env['sed_dens'], 'g/cm**3')
+    sed_density = env['sed_dens'] # g/cm**3
     sed_porosity = env['sed_poro']
     retention_frac = env['retention']
-    delta_age = Q_(env['delta_age'], 'years')
+    delta_age = env['delta_age'] # years
 
-    growth_rate = area / delta_age
-    new_area = area + (growth_rate * Q_(1.0, 'year'))
+    growth_rate = area / delta_age # km**2/year
+    new_area = area + (growth_rate * 1.0) # after one year
     # but this assumes constant growth rate in AREA, not VOLUME of delta...
 
     aggradation = ((Qs * retention_frac / sed_density) / (1.0 - sed_porosity)) / new_area
-    aggradation.to('mm/year').magnitude.to_pickle(str(target[0]))
+    convert(aggradation, 'kg/s/(g/cm**3)/km**2', 'mm/year').to_pickle(str(target[0]))
     return 0
 
 
 def steady_state_subsidence(env, target, source):
-    ureg = pint.UnitRegistry()
-    Q_ = ureg.Quantity
-
-    aggradation = Q_(pandas.read_pickle(str(source[0])),
-            'mm/year')
-    gia_uplift = Q_(pandas.read_pickle(str(source[1])), 'mm/year')
-    eustatic_slr = Q_(env['eustatic_slr'], 'mm/year')
+    aggradation = pandas.read_pickle(str(source[0])) # mm/year
+    gia_uplift = pandas.read_pickle(str(source[1])) # mm/year
+    eustatic_slr = env['eustatic_slr'] # mm/year
 
     # 0 = rslr = slr + subsidence - sedimentation  # Ericson 2006 Eq. 1
     # subsidence = aggradation - slr
     subsidence = aggradation - eustatic_slr - gia_uplift # so subsidence here is compaction+techtonic(non-gia)+gia_sub, (since gia_uplift is positive upwards, but subsidence should be pos down, so subtract)
-    subsidence.to('mm/year').magnitude.to_pickle(str(target[0]))
+    subsidence.to_pickle(str(target[0]))
     return 0
 
 
@@ -203,14 +182,12 @@ def clean_groundwater_stats(env, target, source):
 
 
 def compute_drawdown(env, target, source):
-    Q_ = pint.UnitRegistry().Quantity
-
-    groundwater = Q_(pandas.read_pickle(str(source[0]))['mean'], 'm**3/year') * 1e6
-    areas = Q_(pandas.read_pickle(str(source[1])), 'km**2')
+    groundwater = pandas.read_pickle(str(source[0]))['mean'] * 1e6 # m**3/year
+    areas = pandas.read_pickle(str(source[1])) # km**2
     specific_yield = 0.2
 
     drawdown = groundwater / (areas * specific_yield)  # Ericson 2006 eq. 5
-    drawdown.to('mm/year').magnitude.to_pickle(str(target[0]))
+    convert(drawdown, 'm**3/year/km**2', 'mm/year').to_pickle(str(target[0]))
     return 0
 
 
@@ -324,8 +301,7 @@ def retention_merge_to_df(env, source, target):
 
 
 def compute_retention_from_rslr_lit(env, source, target):
-    ureg = pint.UnitRegistry()
-    Q_ = ureg.Quantity
+    Q_ = unit_registry().Quantity
 
     rslr_lit = Q_(pandas.read_pickle(str(source[0])), 'mm/year')
     Qs_prist = Q_(pandas.read_pickle(str(source[1])).groupby(level='Delta').sum(), 'kg/s')
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# actions import the top-level shared modules (gis, util, ...) by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('rasterio')
+pytest.importorskip('cartopy')
+import rasterio
+import cartopy.crs as ccrs
+import shapely.geometry as sgeom
+from affine import Affine
+
+import gis
+
+
+def polygon_row_areas(lat0, dlat, nrows, dlon):
+    # previous raster_pixel_areas: each row's pixel as a polygon in a
+    # lambert equal area projection centered on the row
+    geod = ccrs.PlateCarree().as_geodetic()
+    areas = []
+    for j in range(nrows):
+        lat = lat0 + j * dlat
+        laea = ccrs.LambertAzimuthalEqualArea(central_longitude=0,
+                                              central_latitude=lat + dlat/2.)
+        poly = sgeom.Polygon(
+                laea.transform_points(geod,
+                                      np.array([-dlon/2., -dlon/2., dlon/2., dlon/2.]),
+                                      np.array([lat, lat + dlat, lat + dlat, lat])))
+        areas.append(poly.area / 1e6)
+    return np.array(areas)
+
+
+def test_lat_band_areas_sum_to_wgs84_surface():
+    total = gis.lat_band_areas(np.linspace(-90, 90, 181), 360.)
+    assert np.isclose(total.sum(), 510065621.724, rtol=1e-9)
+
+
+def test_lat_band_areas_sphere():
+    total = gis.lat_band_areas(np.linspace(90, -90, 7), 360., a=6371000., f=0)
+    assert np.isclose(total.sum(), 4 * np.pi * 6371.**2, rtol=1e-12)
+
+
+def test_raster_pixel_areas_matches_polygon_areas(tmpdir):
+    src = str(tmpdir.join('grid.tif'))
+    dst = str(tmpdir.join('areas.tif'))
+    affine = Affine(1., 0, -10., 0, -1., 90.)
+    with rasterio.open(src, 'w', driver='GTiff', width=20, height=180,
+                       count=1, dtype='uint8', crs={'init': 'epsg:4326'},
+                       transform=affine) as rast:
+        rast.write(np.zeros((180, 20), dtype='uint8'), 1)
+
+    gis.raster_pixel_areas({}, [dst], [src])
+
+    with rasterio.open(dst, 'r') as rast:
+        areas = rast.read(1)
+    expected = polygon_row_areas(90., -1., 180, 1.)
+    # polygon edges are straight in the projection, so the old areas are
+    # only accurate to ~1e-4 at 1 degree
+    assert np.allclose(areas, expected[:, np.newaxis], rtol=1e-4)
+    assert np.all(areas == areas[:, :1])
@@ -0,0 +1,50 @@
+import os
+import sys
+import numpy as np
+import pandas
+import pytest
+
+for module in ['netCDF4', 'geopandas', 'cartopy', 'requests', 'bs4']:
+    pytest.importorskip(module)
+from netCDF4 import Dataset
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'hazards'))
+import process_hazards as ph
+
+
+def write_wave_month(path, ntimes, ny, nx, nullval=-999., seed=0):
+    # layout of the csiro wave files: date and time of day as integers,
+    # Hs and Tm on a (time, y, x) grid with land filled with nullval
+    rng = np.random.RandomState(seed)
+    nc = Dataset(path, 'w')
+    nc.createDimension('time', ntimes)
+    nc.createDimension('y', ny)
+    nc.createDimension('x', nx)
+    hours = 3 * np.arange(ntimes)
+    nc.createVariable('time1', 'i4', ('time',))[:] = 20000101 + hours // 24
+    nc.createVariable('time2', 'i4', ('time',))[:] = (hours % 24) * 10000
+    land = np.zeros((ny, nx), dtype=bool)
+    land[13, 1] = True
+    for name, scale in [('Hs', 5.), ('Tm', 15.)]:
+        var = nc.createVariable(name, 'f4', ('time', 'y', 'x'), zlib=True, fill_value=nullval)
+        data = rng.uniform(0, scale, (ntimes, ny, nx)).astype('f4')
+        data[:, land] = nullval
+        var[:] = data
+    nc.close()
+
+
+def test_read_wave_month_strategies_match(tmpdir):
+    path = str(tmpdir.join('ww3_200001.nc'))
+    write_wave_month(path, 16, 30, 40)
+    indices = {'Ganges': {'y': [3, 4, 4, 6], 'x': [10, 10, 12, 9]},
+               'Mekong': {'y': [20], 'x': [31]},
+               'Nile': {'y': [12, 12, 13], 'x': [0, 2, 1]}}
+
+    block = ph.read_wave_month(path, indices, 'block')
+    pixel = ph.read_wave_month(path, indices, 'pixel')
+
+    assert block.shape == (16, 8)
+    assert list(block.columns) == list(pixel.columns)
+    assert block.index.equals(pixel.index)
+    assert np.array_equal(block.values.astype(float), pixel.values.astype(float), equal_nan=True)
+    # the last nile pixel is on land
+    assert block[('Nile', 2)].isnull().all() and block.drop(('Nile', 2), axis=1).notnull().all().all()
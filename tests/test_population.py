@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import numpy as np
+import pandas
+import pytest
+
+for module in ['rasterio', 'geopandas', 'cartopy', 'rasterstats', 'matplotlib']:
+    pytest.importorskip(module)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'population'))
+import process_population as pp
+
+
+def un_sheet(table):
+    # layout of the UN WPP workbook sheets: 14 rows of preamble, a header row,
+    # then one row per country
+    header = ['Index', 'Variant', 'Country code'] + list(table.columns)
+    rows = [[None] * len(header)] * 14 + [header]
+    rows += [[i, 'v', iso] + table.loc[iso].tolist() for i, iso in enumerate(table.index)]
+    return pandas.DataFrame(rows)
+
+
+def test_forecast_un_pop_elev_matches_country_loop(tmpdir, monkeypatch):
+    rng = np.random.RandomState(0)
+    isos = [4, 50, 356, 704, 818]
+    years = [2000, 2010, 2020, 2030]
+    scenarios = ['estimates', 'low', 'medium', 'high']
+    tables = dict((s, pandas.DataFrame(rng.uniform(1e3, 1e5, (len(isos), len(years))),
+                                      index=isos, columns=years))
+                  for s in scenarios)
+    countries = {
+            'Ganges': {'India': {'iso_num': 356, 'area_frac': .3},
+                       'Bangladesh': {'iso_num': 50, 'area_frac': .7}},
+            'Mekong': {'Vietnam': {'iso_num': 704, 'area_frac': 1.}},
+            'Nile': {'Egypt': {'iso_num': 818, 'area_frac': .9},
+                     'Afghanistan': {'iso_num': 4, 'area_frac': .1}},
+            }
+    delta_pops = pandas.DataFrame(rng.uniform(0, 1e4, (6, 3)),
+                                  index=[0., 1., 2., 3., 4., np.inf],
+                                  columns=['Ganges', 'Mekong', 'Nile'])
+
+    delta_pops.to_pickle(str(tmpdir.join('hypso.pd')))
+    with open(str(tmpdir.join('countries.json')), 'w') as fout:
+        json.dump(countries, fout)
+    sheets = dict((name, un_sheet(tables[s])) for name, s in
+                  zip(['ESTIMATES', 'LOW VARIANT', 'MEDIUM VARIANT', 'HIGH VARIANT'], scenarios))
+    monkeypatch.setattr(pp.pandas, 'read_excel', lambda path, sheetname=None: sheets)
+
+    env = {'popyear': 2010, 'forecasts': [2020, 2030], 'pop_scenario_names': scenarios[1:]}
+    pp.forecast_un_pop_elev(env, [str(tmpdir.join('out.pd'))],
+                            [str(tmpdir.join(f)) for f in ['hypso.pd', 'countries.json', 'wpp.xls']])
+    pop_elevs = pandas.read_pickle(str(tmpdir.join('out.pd')))
+
+    # previous implementation: one growth sum over countries per delta,
+    # scenario and forecast
+    for delta in delta_pops.columns:
+        for scenario in scenarios[1:]:
+            for forecast in env['forecasts']:
+                growth = 0.0
+                for country, cdata in countries[delta].items():
+                    iso = int(cdata['iso_num'])
+                    cur_pop = tables['estimates'][env['popyear']][iso]
+                    growth += tables[scenario][forecast][iso] / cur_pop * cdata['area_frac']
+                expected = delta_pops[delta] * growth
+                assert np.allclose(pop_elevs[delta, forecast, scenario].values,
+                                   expected.values, rtol=1e-12)
+    assert list(pop_elevs.columns.names) == ['Delta', 'Forecast', 'Pop_Scenario']
+
+
+def test_pop_elevation_bins_edges_used_by_rslr_adjustment(tmpdir):
+    # half metre edges, no rise: the curve is only resampled onto tenths of
+    # each interval and every original edge is kept
+    elevs = [0., .5, 1., 1.5, 2., np.inf]
+    columns = pandas.MultiIndex.from_product([['Mekong'], [2000], ['medium']],
+                                             names=['Delta', 'Forecast', 'Pop_Scenario'])
+    pop_elevs = pandas.DataFrame([[0.], [10.], [30.], [35.], [60.], [100.]],
+                                 index=elevs, columns=columns)
+    pop_elevs.to_pickle(str(tmpdir.join('hypso.pd')))
+    pandas.Series([3.], index=['Mekong']).to_pickle(str(tmpdir.join('rslr.pd')))
+
+    pp.adjust_hypso_for_rslr({'elevyear': 2000}, [str(tmpdir.join(f)) for f in ['hypso.pd', 'rslr.pd']],
+                             [str(tmpdir.join('adj.pd'))])
+    adj = pandas.read_pickle(str(tmpdir.join('adj.pd')))
+
+    # grid of a tenth of the finest interval, every original edge on it
+    assert np.allclose(np.diff(adj.index.values), .05)
+    nearest = [np.abs(adj.index.values - e).argmin() for e in elevs[:-1]]
+    assert np.allclose(adj.index.values[nearest], elevs[:-1])
+    assert np.allclose(adj.iloc[nearest].values.ravel(), [0., 10., 30., 35., 60.])
+    assert np.isclose(adj.iloc[5].item(), 5.)
+
+
+def test_adjust_hypso_for_rslr_uses_off_grid_edges(tmpdir):
+    elevs = [0., 1., 2., 2.5, 10/3., np.inf]
+    columns = pandas.MultiIndex.from_product([['Mekong'], [2000], ['medium']],
+                                             names=['Delta', 'Forecast', 'Pop_Scenario'])
+    pop_elevs = pandas.DataFrame([[0.], [10.], [30.], [40.], [60.], [100.]],
+                                 index=elevs, columns=columns)
+    pop_elevs.to_pickle(str(tmpdir.join('hypso.pd')))
+    pandas.Series([3.], index=['Mekong']).to_pickle(str(tmpdir.join('rslr.pd')))
+
+    pp.adjust_hypso_for_rslr({'elevyear': 2000}, [str(tmpdir.join(f)) for f in ['hypso.pd', 'rslr.pd']],
+                             [str(tmpdir.join('adj.pd'))])
+    adj = pandas.read_pickle(str(tmpdir.join('adj.pd')))
+
+    # finest interval .5, so a .05 grid, with 10/3 added to it
+    nearest = [np.abs(adj.index.values - e).argmin() for e in elevs[:-1]]
+    assert 10/3. in adj.index
+    assert np.allclose(adj.index.values[nearest], elevs[:-1])
+    assert np.allclose(adj.iloc[nearest].values.ravel(), [0., 10., 30., 40., 60.])
+
+
+@pytest.mark.parametrize('shared_mask', [True, False])
+def test_extract_delta_ssp_vals_matches_global_warp(tmpdir, monkeypatch, shared_mask):
+    import rasterio
+    import geopandas
+    import shapely.geometry as sgeom
+    from affine import Affine
+
+    rng = np.random.RandomState(0)
+    names = ['SSP1', 'SSP2']
+    years = [2030, 2050, 2070]
+    affine = Affine(.5, 0, -180., 0, -.5, 90.)
+    nodata = -1.
+    rasts = {}
+    for ssp in names:
+        data = rng.uniform(0, 1000, (len(years), 360, 720)).astype('float32')
+        if shared_mask:
+            data[:, rng.rand(360, 720) < .05] = nodata
+        else:
+            data[rng.rand(*data.shape) < .05] = nodata
+        rasts[ssp] = data
+        with rasterio.open(str(tmpdir.join(ssp + '.tif')), 'w', driver='GTiff',
+                           width=720, height=360, count=len(years), dtype='float32',
+                           crs={'init': 'epsg:4326'}, transform=affine, nodata=nodata) as rast:
+            rast.write(data)
+    deltas = geopandas.GeoDataFrame(
+            {'Delta': ['Ganges', 'Mekong', 'Nile'],
+             'geometry': [sgeom.box(88.2, 21.3, 91.7, 24.1),
+                          sgeom.box(104.6, 8.7, 106.9, 11.2),
+                          sgeom.box(29.6, 30.4, 32.3, 31.6)]},
+            crs={'init': 'epsg:4326'})
+    deltas.to_file(str(tmpdir.join('deltas.shp')))
+
+    # keep every warped band, in call order (delta, ssp, then year)
+    bands = []
+    ndims = []
+    global_reproject = pp.reproject
+    def windowed_reproject(source, destination, src_transform, src_crs, src_nodata,
+                           dst_transform, dst_crs, dst_nodata, resampling):
+        global_reproject(source, destination, src_transform=src_transform, src_crs=src_crs,
+                         src_nodata=src_nodata, dst_transform=dst_transform, dst_crs=dst_crs,
+                         dst_nodata=dst_nodata, resampling=resampling)
+        ndims.append((source.ndim, destination.ndim))
+        bands.append((destination.copy(), dst_transform, dst_crs))
+    monkeypatch.setattr(pp, 'reproject', windowed_reproject)
+
+    env = {'ssp_names': names, 'ssp_years': years}
+    pp.extract_delta_ssp_vals(env, [str(tmpdir.join(f)) for f in ['deltas.shp', 'SSP1.tif', 'SSP2.tif']],
+                              [str(tmpdir.join('out.pd'))])
+
+    # single band arrays only, as the original global warp used
+    assert set(ndims) == {(2, 2)}
+    assert len(bands) == len(deltas) * len(names) * len(years)
+    for k, (proj, dst_affine, dst_crs) in enumerate(bands):
+        ssp = names[k // len(years) % len(names)]
+        # previous implementation: one warp of the whole global band
+        expected = np.ones(proj.shape, dtype='float64')
+        global_reproject(rasts[ssp][k % len(years)], expected, src_transform=affine,
+                         src_crs={'init': 'epsg:4326'}, src_nodata=nodata,
+                         dst_transform=dst_affine, dst_crs=dst_crs, dst_nodata=nodata,
+                         resampling=pp.RESAMPLING.bilinear)
+        # the window origin shifts the pixel coordinate arithmetic slightly
+        assert np.array_equal(proj == nodata, expected == nodata)
+        assert np.allclose(proj, expected, rtol=1e-12, atol=1e-9)
@@ -0,0 +1,34 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+for module in ['rasterio', 'fiona', 'cartopy', 'matplotlib', 'networkx']:
+    pytest.importorskip(module)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sediment'))
+import process_sediment as ps
+import river_network as rn
+
+
+def test_place_reservoirs_breaks_ties_by_topological_order():
+    # two equal branches: 4 -> 2 -> 1 -> 0 and 5 -> 3 -> 1
+    down = np.array([-1, 0, 1, 1, 2, 3])
+    order, depth = rn.topological_order(down)
+    net = rn.Network(np.arange(6), np.zeros(6), down, order, depth, 0)
+    upstream = rn.upstream_matrix(net, 1)
+    potential = np.array([0, 0, 1, 1, 1, 1], dtype=np.float32)
+    rank = list(order).index
+
+    # nodes 1, 2 and 3 tie; the tie goes to the node earliest in
+    # topological order, which puts the deeper branch nodes first
+    res = ps.place_reservoirs(net, upstream, potential, np.zeros(6, dtype=np.float32), [1.], 1)
+    first = min([1, 2, 3], key=rank)
+    assert first in (2, 3)
+    assert res[first] == 1. and res.sum() == 1.
+
+    # the reservoir spends the potential above it, so the other branch
+    # node now ties with node 1 and wins again by order
+    res = ps.place_reservoirs(net, upstream, potential, np.zeros(6, dtype=np.float32), [1., .5], 1)
+    second = 5 - first
+    assert rank(second) < rank(1)
+    assert res[first] == 1. and res[second] == .5 and res.sum() == 1.5
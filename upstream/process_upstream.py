@@ -3,6 +3,8 @@ import numpy as np
 import pandas
 import rasterio
 
+import basin_index as bi
+
 
 def make_rast_val(env, target, source):
     val = env['val']
@@ -33,21 +35,8 @@ def agg_over_basins(env, target, source):
     sending in a dummy placeholder raster for weights.
     '''
     method = env['method']
-    if method == 'sum':
-        aggregate = lambda data, _: np.sum(data)
-    elif method == 'weightedsum':
-        aggregate = lambda data, weights: np.sum(data * weights)
-    elif method == 'mean':
-        aggregate = lambda data, _: np.mean(data)
-    elif method == 'weightedmean':
-        aggregate = lambda data, weights: np.sum(data * weights) / np.sum(weights)
-    elif method == 'max':
-        aggregate = lambda data, _: np.max(data)
-    else:
-        raise ValueError, 'method must be sum, weightedsum, mean, weightedmean, max'
 
-    with rasterio.open(str(source[0]), 'r') as basins_rast:
-        basins = basins_rast.read(1)
+    index = bi.load_pixel_index(str(source[0]))
     basin_ids = pandas.read_pickle(str(source[1]))
     with rasterio.open(str(source[2]), 'r') as data_rast:
         data = data_rast.read(1, masked=True)
@@ -57,19 +46,67 @@ def agg_over_basins(env, target, source):
     else:
         weights = np.ones_like(data)
 
-    aggregated = []
-    for delta, basinid in basin_ids.index:
-        pixels = (basins==basinid)
-        aggregated.append(aggregate(data[pixels], weights[pixels]))
+    basinids = basin_ids.index.get_level_values('BasinID')
+    aggregated = bi.aggregate_by_basin(index, data, weights, method, basinids)
     if np.ma.masked in aggregated:
-        fill = env['fill']
-        if fill == 'mean':
-            fill = (data * weights).sum() / weights[~data.mask].sum()
-    aggregated = [a if a is not np.ma.masked else fill for a in aggregated]
+        aggregated = fill_masked_basins(aggregated, data, weights, env['fill'])
     pandas.Series(aggregated, index=basin_ids.index).to_pickle(str(target[0]))
     return 0
 
 
+def agg_multi_over_basins(env, target, source):
+    '''
+    Same as agg_over_basins for several rasters at once, sharing one read of
+    the basin pixel index, basin ids and weights.
+
+    Sources are the basin pixel index, basin ids, weights raster, then the data
+    rasters.  env['methods'] and env['fills'] give the method and fill value
+    for each target (fill None if no fill is expected).  Targets flagged in
+    env['use_weights'] aggregate the weights raster itself (e.g. summed pixel
+    areas for basin area) and have no data raster in the source list.
+    '''
+    methods = env['methods']
+    fills = env['fills']
+    use_weights = env['use_weights']
+    rasters = iter(source[3:])
+    assert len(target) == len(methods) == len(fills) == len(use_weights)
+
+    index = bi.load_pixel_index(str(source[0]))
+    basin_ids = pandas.read_pickle(str(source[1]))
+    with rasterio.open(str(source[2]), 'r') as weight_rast:
+        areas = weight_rast.read(1)
+        areas_masked = weight_rast.read(1, masked=True)
+
+    basinids = basin_ids.index.get_level_values('BasinID')
+
+    for method, fill, is_weights, out in zip(methods, fills, use_weights, target):
+        if is_weights:
+            rast = source[2]
+            data = areas_masked
+        else:
+            rast = next(rasters)
+            with rasterio.open(str(rast), 'r') as data_rast:
+                data = data_rast.read(1, masked=True)
+        if method in ['weightedsum', 'weightedmean']:
+            weights = areas
+        else:
+            weights = np.ones_like(data)
+
+        aggregated = bi.aggregate_by_basin(index, data, weights, method, basinids)
+        if np.ma.masked in aggregated:
+            if fill is None:
+                raise ValueError('{} has basins with no data, needs a fill value'.format(rast))
+            aggregated = fill_masked_basins(aggregated, data, weights, fill)
+        pandas.Series(aggregated, index=basin_ids.index).to_pickle(str(out))
+    return 0
+
+
+def fill_masked_basins(aggregated, data, weights, fill):
+    if fill == 'mean':
+        fill = (data * weights).sum() / weights[~data.mask].sum()
+    return [a if a is not np.ma.masked else fill for a in aggregated]
+
+
 def convert_m_to_km(env, target, source):
     p = pandas.read_pickle(str(source[0]))
     (p / 1e3).to_pickle(str(target[0]))
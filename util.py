@@ -1,7 +1,9 @@
 import os
+import errno
 from functools import wraps
 from multiprocessing import Process, Queue
 import logging, logging.handlers
+import numpy as np
 
 
 def in_new_process(func):
@@ -22,6 +24,69 @@ def in_new_process(func):
     return wrapper
 
 
+def makedirs(path):
+    # create a directory and its parents. an existing directory is fine, so
+    # parallel actions can race to create a shared cache directory
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def num_processes():
+    # worker processes for actions that parallelize internally, from the
+    # DELTA_PROCESSES environment variable, else 1. not taken from scons -j,
+    # since each of the j concurrent actions would start j workers
+    try:
+        return max(1, int(os.environ['DELTA_PROCESSES']))
+    except KeyError:
+        return 1
+
+
+# shared pint registry, created on first use. building one parses the unit
+# definitions, which is slow to repeat in every action
+UREG = None
+
+def unit_registry():
+    global UREG
+    if UREG is None:
+        import pint
+        UREG = pint.UnitRegistry()
+    return UREG
+
+
+# fixed conversion factors, as pint computes them. with DELTA_CHECK_UNITS
+# set, convert() also converts through pint and checks the result
+UNIT_FACTORS = {
+        ('km**3', 'm**3'): 1e9,
+        ('m**3', 'km**3'): 1e-9,
+        ('m**3/s', 'm**3/year'): 31556925.9747,
+        ('m**3/s', 'km**3/year'): 0.0315569259747,
+        ('mm', 'm'): 1e-3,
+        ('km**2*m', 'km**3'): 1e-3,
+        ('m**3/year/km**2', 'mm/year'): 1e-3,
+        # sediment flux over density and area to aggradation rate
+        ('kg/s/(g/cm**3)/km**2', 'mm/year'): 31.5569259747,
+        }
+
+
+def convert(values, units, to_units):
+    # scale values (scalar, array or pandas object) from units to to_units
+    try:
+        factor = UNIT_FACTORS[(units, to_units)]
+    except KeyError:
+        Q_ = unit_registry().Quantity
+        factor = UNIT_FACTORS[(units, to_units)] = Q_(1.0, units).to(to_units).magnitude
+    converted = values * factor
+    if os.environ.get('DELTA_CHECK_UNITS'):
+        Q_ = unit_registry().Quantity
+        checked = Q_(values, units).to(to_units).magnitude
+        if not np.allclose(converted, checked, equal_nan=True):
+            raise ValueError('{0} to {1}: conversion table disagrees with pint'.format(units, to_units))
+    return converted
+
+
 def getLogger(target):
     pathdirs = str(target[0]).split(os.path.sep)
     if 'experiments' in pathdirs: